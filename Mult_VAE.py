@@ -1,80 +1,20 @@
+import argparse
 import os
-import shutil
-import sys
-import numpy as np
-from scipy import sparse
 
-import matplotlib.pyplot as plt
-# %matplotlib inline
-
-import seaborn as sn
-sn.set()
-
-import pandas as pd
 import tensorflow as tf
 from tensorflow.contrib.layers import apply_regularization, l2_regularizer
-import bottleneck as bn
-
-
-def get_count(tp, id):
-    playcount_groupbyid = tp[[id]].groupby(id, as_index=False)
-    count = playcount_groupbyid.size()
-    return count
-
-
-def filter_triplets(tp, min_uc=5, min_sc=0):
-    # Only keep the triplets for items which were clicked on by at least min_sc users.
-    if min_sc > 0:
-        itemcount = get_count(tp, 'movieId')
-        tp = tp[tp['movieId'].isin(itemcount.index[itemcount >= min_sc])]
-
-    # Only keep the triplets for users who clicked on at least min_uc items
-    # After doing this, some of the items will have less than min_uc users, but should only be a small proportion
-    if min_uc > 0:
-        usercount = get_count(tp, 'userId')
-        tp = tp[tp['userId'].isin(usercount.index[usercount >= min_uc])]
-
-    # Update both usercount and itemcount after filtering
-    usercount, itemcount = get_count(tp, 'userId'), get_count(tp, 'movieId')
-    return tp, usercount, itemcount
-
-
-def split_train_test_proportion(data, test_prop=0.2):
-    data_grouped_by_user = data.groupby('userId')
-    tr_list, te_list = list(), list()
-
-    np.random.seed(98765)
 
-    for i, (_, group) in enumerate(data_grouped_by_user):
-        n_items_u = len(group)
+import models
+import preprocessing
+import tf_ops
+import training
 
-        if n_items_u >= 5:
-            idx = np.zeros(n_items_u, dtype='bool')
-            idx[np.random.choice(n_items_u, size=int(test_prop * n_items_u), replace=False).astype('int64')] = True
-
-            tr_list.append(group[np.logical_not(idx)])
-            te_list.append(group[idx])
-        else:
-            tr_list.append(group)
-
-        if i % 1000 == 0:
-            print("%d users sampled" % i)
-            sys.stdout.flush()
-
-    data_tr = pd.concat(tr_list)
-    data_te = pd.concat(te_list)
-
-    return data_tr, data_te
-
-
-def numerize(tp, profile2id, show2id):
-    uid = map(lambda x: profile2id[x], tp['userId'])
-    sid = map(lambda x: show2id[x], tp['movieId'])
-    return pd.DataFrame(data={'uid': list(uid), 'sid': list(sid)}, columns=['uid', 'sid'])
+DATA_DIR = '/media/data1/dingcheng/workspace/baidu/big-data-lab/cf/ml-20m/'
 
 
 class MultiDAE(object):
-    def __init__(self, p_dims, q_dims=None, lam=0.01, lr=1e-3, random_seed=None):
+    def __init__(self, p_dims, q_dims=None, lam=0.01, lr=1e-3, random_seed=None, sparse_input=False,
+                 n_sampled=0, item_counts_file=None, n_shards=1, shard_devices=None):
         self.p_dims = p_dims
         if q_dims is None:
             self.q_dims = p_dims[::-1]          # reverse of p
@@ -87,46 +27,81 @@ class MultiDAE(object):
         self.lam = lam             # scale of l2 regularizer
         self.lr = lr               # learning rate of Adam optimizer
         self.random_seed = random_seed
+        self.sparse_input = sparse_input   # feed input_ph as a tf.SparseTensorValue
+        self.n_sampled = n_sampled         # > 0: train with a sampled softmax over this many negatives
+        self.item_counts_file = item_counts_file  # popularity counts of the negatives' proposal (uniform if None)
+        self.n_shards = n_shards           # > 1: the n_items-sized layers are split into item ranges
+        self.shard_devices = shard_devices # device of each item-range shard (None: the default device)
 
         self.construct_placeholders()
 
     def construct_placeholders(self):
-        self.input_ph = tf.placeholder(
-            dtype=tf.float32, shape=[None, self.dims[0]])            # profile history
+        if self.sparse_input:
+            self.input_ph = tf.sparse_placeholder(
+                dtype=tf.float32, shape=[None, self.dims[0]])
+        else:
+            self.input_ph = tf.placeholder(
+                dtype=tf.float32, shape=[None, self.dims[0]])            # profile history
         self.keep_prob_ph = tf.placeholder_with_default(1.0, shape=None)
 
     def build_graph(self):
+        saver, logits, loss = self.loss_graph()
+
+        train_op = tf.train.AdamOptimizer(self.lr).minimize(loss)
+
+        merged = tf.summary.merge_all()
+        return saver, logits, loss, train_op, merged
 
+    def loss_graph(self):
+        # weights, forward pass and training loss without the optimizer, so that
+        # parallel.build_towers can build one per tower around shared variables
         self.construct_weights()
 
         saver, logits = self.forward_pass()
-        log_softmax_var = tf.nn.log_softmax(logits)
+        if self.n_shards > 1:
+            # logits per item range, for the loss and top-k without the full [batch, n_items] matrix
+            self.logit_shards = tf_ops.output_shards(self.output_input, self.weights[-1], self.biases[-1])
 
         # per-user average negative log-likelihood
-        neg_ll = -tf.reduce_mean(tf.reduce_sum(
-            log_softmax_var * self.input_ph, axis=1))
+        if self.n_sampled > 0:
+            neg_ll = tf_ops.sampled_softmax_nll(self.output_input, self.weights[-1], self.biases[-1],
+                                                self.input_ph, self.n_sampled, self.item_counts_file)
+        elif self.n_shards > 1:
+            neg_ll = tf_ops.sharded_multinomial_nll(self.logit_shards, self.input_ph)
+        else:
+            log_softmax_var = tf.nn.log_softmax(logits)
+            neg_ll = -tf.reduce_mean(tf_ops.rowwise_sum_product(
+                log_softmax_var, self.input_ph))
         # apply regularization to weights
         reg = l2_regularizer(self.lam)
-        reg_var = apply_regularization(reg, self.weights)      # reg_var: the overall reg penalty
+        # reg_var: the overall reg penalty
+        reg_var = apply_regularization(reg, tf_ops.all_shards(self.weights))
         # tensorflow l2 regularization multiply 0.5 to the l2 norm
         # multiply 2 so that it is back in the same scale
         loss = neg_ll + 2 * reg_var
 
-        train_op = tf.train.AdamOptimizer(self.lr).minimize(loss)
-
         # add summary statistics
         tf.summary.scalar('negative_multi_ll', neg_ll)
         tf.summary.scalar('loss', loss)
-        merged = tf.summary.merge_all()
-        return saver, logits, loss, train_op, merged
+        return saver, logits, loss
+
+    def topk_graph(self, logits, k):
+        # top-k (values, indices) per user with the items of input_ph excluded, so only
+        # [batch, k] leaves the session instead of the full logits
+        if self.n_shards > 1:
+            # merged from a top-k per item-range shard; the full logits are never concatenated
+            return tf_ops.sharded_topk(self.logit_shards, self.input_ph, k)
+        return tf.nn.top_k(tf_ops.mask_seen(logits, self.input_ph), k)
 
     def forward_pass(self):
         # construct forward graph
-        h = tf.nn.l2_normalize(self.input_ph, 1)             # Normalizes input_ph along dimension 1
-        h = tf.nn.dropout(h, self.keep_prob_ph)
+        h = tf_ops.l2_normalize_rows(self.input_ph)             # Normalizes input_ph along dimension 1
+        h = tf_ops.dropout(h, self.keep_prob_ph)
 
         for i, (w, b) in enumerate(zip(self.weights, self.biases)):
-            h = tf.matmul(h, w) + b
+            if i == len(self.weights) - 1:
+                self.output_input = h             # input of the output layer, for the sampled softmax
+            h = tf_ops.matmul(h, w) + b
 
             if i != len(self.weights) - 1:
                 h = tf.nn.tanh(h)
@@ -140,19 +115,31 @@ class MultiDAE(object):
             weight_key = "weight_{}to{}".format(i, i + 1)
             bias_key = "bias_{}".format(i + 1)
 
-            self.weights.append(tf.get_variable(
-                name=weight_key, shape=[d_in, d_out],
-                initializer=tf.contrib.layers.xavier_initializer(
-                    seed=self.random_seed)))
-
-            self.biases.append(tf.get_variable(
-                name=bias_key, shape=[d_out],
-                initializer=tf.truncated_normal_initializer(
-                    stddev=0.001, seed=self.random_seed)))
+            if i in (0, len(self.dims) - 2) and self.n_shards > 1:
+                # the first layer's rows and the output layer's columns (and bias) by item range
+                item_axis = 0 if i == 0 else 1
+                self.weights.append(tf_ops.item_sharded_variable(
+                    weight_key, [d_in, d_out], item_axis, self.n_shards,
+                    tf.glorot_uniform_initializer(seed=self.random_seed), self.shard_devices))
+            else:
+                self.weights.append(tf.get_variable(
+                    name=weight_key, shape=[d_in, d_out],
+                    initializer=tf.contrib.layers.xavier_initializer(
+                        seed=self.random_seed)))
+
+            if i == len(self.dims) - 2 and self.n_shards > 1:
+                self.biases.append(tf_ops.item_sharded_variable(
+                    bias_key, [d_out], 0, self.n_shards,
+                    tf.truncated_normal_initializer(stddev=0.001, seed=self.random_seed), self.shard_devices))
+            else:
+                self.biases.append(tf.get_variable(
+                    name=bias_key, shape=[d_out],
+                    initializer=tf.truncated_normal_initializer(
+                        stddev=0.001, seed=self.random_seed)))
 
             # add summary stats
-            tf.summary.histogram(weight_key, self.weights[-1])
-            tf.summary.histogram(bias_key, self.biases[-1])
+            tf_ops.histogram_summaries(weight_key, self.weights[-1])
+            tf_ops.histogram_summaries(bias_key, self.biases[-1])
 
 
 class MultiVAE(MultiDAE):
@@ -164,19 +151,33 @@ class MultiVAE(MultiDAE):
         self.is_training_ph = tf.placeholder_with_default(0., shape=None)
         self.anneal_ph = tf.placeholder_with_default(1., shape=None)              # beta
 
-    def build_graph(self):
+    def loss_graph(self):
         self._construct_weights()
 
         saver, logits, KL = self.forward_pass()
+        if self.n_shards > 1:
+            # logits per item range, for the loss and top-k without the full [batch, n_items] matrix
+            self.logit_shards = tf_ops.output_shards(self.output_input, self.weights_p[-1], self.biases_p[-1])
         log_softmax_var = tf.nn.log_softmax(logits)
         #log_softmax_var2 = tf.exp(logits)
 
         #neg_ll = -tf.reduce_mean(tf.reduce_sum(                  # Multinomial
         #    log_softmax_var * self.input_ph,
         #    axis=-1))
-        neg_ll = tf.reduce_mean(tf.reduce_sum(
-            tf.nn.sigmoid_cross_entropy_with_logits(labels=self.input_ph, logits=logits),
-            axis=-1))
+        if self.n_sampled > 0:
+            # the sampled objective is a (multinomial) sampled softmax, not the sigmoid cross-entropy
+            neg_ll = tf_ops.sampled_softmax_nll(self.output_input, self.weights_p[-1], self.biases_p[-1],
+                                                self.input_ph, self.n_sampled, self.item_counts_file)
+        elif self.n_shards > 1:
+            neg_ll = tf_ops.sharded_sigmoid_nll(self.logit_shards, self.input_ph)
+        elif self.sparse_input:
+            # sigmoid cross-entropy summed over items is softplus(logits) - logits * labels
+            neg_ll = tf.reduce_mean(tf.reduce_sum(tf.nn.softplus(logits), axis=-1) -
+                                    tf_ops.rowwise_sum_product(logits, self.input_ph))
+        else:
+            neg_ll = tf.reduce_mean(tf.reduce_sum(
+                tf.nn.sigmoid_cross_entropy_with_logits(labels=self.input_ph, logits=logits),
+                axis=-1))
         #neg_ll = -tf.reduce_mean(tf.reduce_sum(                 # Poisson
         #    -log_softmax_var2 + logits * self.input_ph,
         #    axis=-1))
@@ -190,29 +191,26 @@ class MultiVAE(MultiDAE):
         # apply regularization to weights
         reg = l2_regularizer(self.lam)
 
-        reg_var = apply_regularization(reg, self.weights_q + self.weights_p)
+        reg_var = apply_regularization(reg, tf_ops.all_shards(self.weights_q + self.weights_p))
         # tensorflow l2 regularization multiply 0.5 to the l2 norm
         # multiply 2 so that it is back in the same scale
         neg_ELBO = neg_ll + self.anneal_ph * KL + 2 * reg_var
 
-        train_op = tf.train.AdamOptimizer(self.lr).minimize(neg_ELBO)
-
         # add summary statistics
         tf.summary.scalar('negative_multi_ll', neg_ll)
         tf.summary.scalar('KL', KL)
         tf.summary.scalar('neg_ELBO_train', neg_ELBO)
-        merged = tf.summary.merge_all()
 
-        return saver, logits, neg_ELBO, train_op, merged
+        return saver, logits, neg_ELBO
 
     def q_graph(self):
         mu_q, std_q, KL = None, None, None
 
-        h = tf.nn.l2_normalize(self.input_ph, 1)
-        h = tf.nn.dropout(h, self.keep_prob_ph)
+        h = tf_ops.l2_normalize_rows(self.input_ph)
+        h = tf_ops.dropout(h, self.keep_prob_ph)
 
         for i, (w, b) in enumerate(zip(self.weights_q, self.biases_q)):
-            h = tf.matmul(h, w) + b
+            h = tf_ops.matmul(h, w) + b
 
             if i != len(self.weights_q) - 1:
                 h = tf.nn.tanh(h)
@@ -230,6 +228,8 @@ class MultiVAE(MultiDAE):
         h = z
 
         for i, (w, b) in enumerate(zip(self.weights_p, self.biases_p)):
+            if i == len(self.weights_p) - 1:
+                self.output_input = h             # input of the output layer, for the sampled softmax
             h = tf.matmul(h, w) + b
 
             if i != len(self.weights_p) - 1:
@@ -261,10 +261,16 @@ class MultiVAE(MultiDAE):
             weight_key = "weight_q_{}to{}".format(i, i + 1)
             bias_key = "bias_q_{}".format(i + 1)
 
-            self.weights_q.append(tf.get_variable(
-                name=weight_key, shape=[d_in, d_out],
-                initializer=tf.contrib.layers.xavier_initializer(
-                    seed=self.random_seed)))
+            if i == 0 and self.n_shards > 1:
+                # one item range of the rows per shard (glorot_uniform is xavier over the full shape)
+                self.weights_q.append(tf_ops.item_sharded_variable(
+                    weight_key, [d_in, d_out], 0, self.n_shards,
+                    tf.glorot_uniform_initializer(seed=self.random_seed), self.shard_devices))
+            else:
+                self.weights_q.append(tf.get_variable(
+                    name=weight_key, shape=[d_in, d_out],
+                    initializer=tf.contrib.layers.xavier_initializer(
+                        seed=self.random_seed)))
 
             self.biases_q.append(tf.get_variable(
                 name=bias_key, shape=[d_out],
@@ -272,448 +278,71 @@ class MultiVAE(MultiDAE):
                     stddev=0.001, seed=self.random_seed)))
 
             # add summary stats
-            tf.summary.histogram(weight_key, self.weights_q[-1])
-            tf.summary.histogram(bias_key, self.biases_q[-1])
+            tf_ops.histogram_summaries(weight_key, self.weights_q[-1])
+            tf_ops.histogram_summaries(bias_key, self.biases_q[-1])
 
         self.weights_p, self.biases_p = [], []
 
         for i, (d_in, d_out) in enumerate(zip(self.p_dims[:-1], self.p_dims[1:])):
             weight_key = "weight_p_{}to{}".format(i, i + 1)
             bias_key = "bias_p_{}".format(i + 1)
-            self.weights_p.append(tf.get_variable(
-                name=weight_key, shape=[d_in, d_out],
-                initializer=tf.contrib.layers.xavier_initializer(
-                    seed=self.random_seed)))
+            if i == len(self.p_dims[:-1]) - 1 and self.n_shards > 1:
+                # one item range of the columns (and of the bias) per shard
+                self.weights_p.append(tf_ops.item_sharded_variable(
+                    weight_key, [d_in, d_out], 1, self.n_shards,
+                    tf.glorot_uniform_initializer(seed=self.random_seed), self.shard_devices))
+                self.biases_p.append(tf_ops.item_sharded_variable(
+                    bias_key, [d_out], 0, self.n_shards,
+                    tf.truncated_normal_initializer(stddev=0.001, seed=self.random_seed), self.shard_devices))
+            else:
+                self.weights_p.append(tf.get_variable(
+                    name=weight_key, shape=[d_in, d_out],
+                    initializer=tf.contrib.layers.xavier_initializer(
+                        seed=self.random_seed)))
 
-            self.biases_p.append(tf.get_variable(
-                name=bias_key, shape=[d_out],
-                initializer=tf.truncated_normal_initializer(
-                    stddev=0.001, seed=self.random_seed)))
+                self.biases_p.append(tf.get_variable(
+                    name=bias_key, shape=[d_out],
+                    initializer=tf.truncated_normal_initializer(
+                        stddev=0.001, seed=self.random_seed)))
 
             # add summary stats
-            tf.summary.histogram(weight_key, self.weights_p[-1])
-            tf.summary.histogram(bias_key, self.biases_p[-1])
-
-
-def load_train_data(csv_file, n_items):
-    tp = pd.read_csv(csv_file)
-    n_users = tp['uid'].max() + 1
-
-    rows, cols = tp['uid'], tp['sid']
-    data = sparse.csr_matrix((np.ones_like(rows),
-                             (rows, cols)), dtype='float64',
-                             shape=(n_users, n_items))
-    return data
-
-
-def load_tr_te_data(csv_file_tr, csv_file_te, n_items):
-    tp_tr = pd.read_csv(csv_file_tr)
-    tp_te = pd.read_csv(csv_file_te)
-
-    start_idx = min(tp_tr['uid'].min(), tp_te['uid'].min())
-    end_idx = max(tp_tr['uid'].max(), tp_te['uid'].max())
-
-    rows_tr, cols_tr = tp_tr['uid'] - start_idx, tp_tr['sid']
-    rows_te, cols_te = tp_te['uid'] - start_idx, tp_te['sid']
+            tf_ops.histogram_summaries(weight_key, self.weights_p[-1])
+            tf_ops.histogram_summaries(bias_key, self.biases_p[-1])
 
-    data_tr = sparse.csr_matrix((np.ones_like(rows_tr), (rows_tr, cols_tr)), dtype='float64',
-                                shape=(end_idx - start_idx + 1, n_items))
-    data_te = sparse.csr_matrix((np.ones_like(rows_te),
-                                 (rows_te, cols_te)), dtype='float64', shape=(end_idx - start_idx + 1, n_items))
-    return data_tr, data_te
 
-
-def NDCG_binary_at_k_batch(X_pred, heldout_batch, k=100):
-    '''
-    normalized discounted cumulative gain@k for binary relevance
-    ASSUMPTIONS: all the 0's in heldout_data indicate 0 relevance
-    '''
-    batch_users = X_pred.shape[0]
-    idx_topk_part = bn.argpartition(-X_pred, k, axis=1)
-    topk_part = X_pred[np.arange(batch_users)[:, np.newaxis],
-                       idx_topk_part[:, :k]]
-    idx_part = np.argsort(-topk_part, axis=1)
-    # X_pred[np.arange(batch_users)[:, np.newaxis], idx_topk] is the sorted
-    # topk predicted score
-    idx_topk = idx_topk_part[np.arange(batch_users)[:, np.newaxis], idx_part]
-    # build the discount template
-    tp = 1. / np.log2(np.arange(2, k + 2))
-
-    DCG = (heldout_batch[np.arange(batch_users)[:, np.newaxis],
-                         idx_topk].toarray() * tp).sum(axis=1)
-    IDCG = np.array([(tp[:min(n, k)]).sum()
-                     for n in heldout_batch.getnnz(axis=1)])
-    return DCG / IDCG
-
-
-def Recall_at_k_batch(X_pred, heldout_batch, k=100):
-    batch_users = X_pred.shape[0]
-
-    idx = bn.argpartition(-X_pred, k, axis=1)
-    X_pred_binary = np.zeros_like(X_pred, dtype=bool)
-    X_pred_binary[np.arange(batch_users)[:, np.newaxis], idx[:, :k]] = True
-
-    X_true_binary = (heldout_batch > 0).toarray()
-    tmp = (np.logical_and(X_true_binary, X_pred_binary).sum(axis=1)).astype(
-        np.float32)
-    recall = tmp / np.minimum(k, X_true_binary.sum(axis=1))
-    return recall
-
-
-def main():
-    import os
+def main(data_dir=DATA_DIR, n_shards=1, shard_devices=None, **options):
     os.environ['CUDA_VISIBLE_DEVICES']='5'
-    DATA_DIR = '/media/data1/dingcheng/workspace/baidu/big-data-lab/cf/ml-20m/'
-    raw_data = pd.read_csv(os.path.join(DATA_DIR, 'ratings.csv'), header=0)
-    # binarize the data (only keep ratings >= 4)
-    raw_data = raw_data[raw_data['rating'] > 3.5]
-    # only keep items that are clicked on by at least 5 users
-    raw_data, user_activity, item_popularity = filter_triplets(raw_data, min_uc=5, min_sc=0)
-    sparsity = 1. * raw_data.shape[0] / (user_activity.shape[0] * item_popularity.shape[0])
-    print("After filtering, there are %d watching events from %d users and %d movies (sparsity: %.3f%%)" %
-          (raw_data.shape[0], user_activity.shape[0], item_popularity.shape[0], sparsity * 100))
-    unique_uid = user_activity.index
-
-    np.random.seed(98765)
-    idx_perm = np.random.permutation(unique_uid.size)
-    # np.savetxt('idx_prm.txt', idx_perm, fmt='%d')
-    # idx_perm = np.loadtxt('idx_prm.txt', dtype=int)
-    unique_uid = unique_uid[idx_perm]
-    # create train/validation/test users
-    n_users = unique_uid.size
-    n_heldout_users = 10000
-    tr_users = unique_uid[:(n_users - n_heldout_users * 2)]
-    vd_users = unique_uid[(n_users - n_heldout_users * 2): (n_users - n_heldout_users)]
-    te_users = unique_uid[(n_users - n_heldout_users):]
-    train_plays = raw_data.loc[raw_data['userId'].isin(tr_users)]
-    unique_sid = pd.unique(train_plays['movieId'])
-    show2id = dict((sid, i) for (i, sid) in enumerate(unique_sid))
-    profile2id = dict((pid, i) for (i, pid) in enumerate(unique_uid))
-    pro_dir = os.path.join(DATA_DIR, 'pro_sg')
-
-    if not os.path.exists(pro_dir):
-        os.makedirs(pro_dir)
-
-    with open(os.path.join(pro_dir, 'unique_sid.txt'), 'w') as f:
-        for sid in unique_sid:
-            f.write('%s\n' % sid)
-    vad_plays = raw_data.loc[raw_data['userId'].isin(vd_users)]
-    vad_plays = vad_plays.loc[vad_plays['movieId'].isin(unique_sid)]
-    vad_plays_tr, vad_plays_te = split_train_test_proportion(vad_plays)
-    test_plays = raw_data.loc[raw_data['userId'].isin(te_users)]
-    test_plays = test_plays.loc[test_plays['movieId'].isin(unique_sid)]
-    test_plays_tr, test_plays_te = split_train_test_proportion(test_plays)
-
-    # Save the data into (user_index, item_index) format
-    train_data = numerize(train_plays, profile2id, show2id)
-    train_data.to_csv(os.path.join(pro_dir, 'train.csv'), index=False)
-    vad_data_tr = numerize(vad_plays_tr, profile2id, show2id)
-    vad_data_tr.to_csv(os.path.join(pro_dir, 'validation_tr.csv'), index=False)
-    vad_data_te = numerize(vad_plays_te, profile2id, show2id)
-    vad_data_te.to_csv(os.path.join(pro_dir, 'validation_te.csv'), index=False)
-    test_data_tr = numerize(test_plays_tr, profile2id, show2id)
-    test_data_tr.to_csv(os.path.join(pro_dir, 'test_tr.csv'), index=False)
-    test_data_te = numerize(test_plays_te, profile2id, show2id)
-    test_data_te.to_csv(os.path.join(pro_dir, 'test_te.csv'), index=False)
-
-    # Load the pre-processed training and validation data
-    unique_sid = list()
-    with open(os.path.join(pro_dir, 'unique_sid.txt'), 'r') as f:
-        for line in f:
-            unique_sid.append(line.strip())
-
-    n_items = len(unique_sid)
-    train_data = load_train_data(os.path.join(pro_dir, 'train.csv'), n_items)
-    vad_data_tr, vad_data_te = load_tr_te_data(os.path.join(pro_dir, 'validation_tr.csv'),
-                                               os.path.join(pro_dir, 'validation_te.csv'), n_items)
-
-    # Set up training hyperparameters
-    N = train_data.shape[0]
-    idxlist = list(range(N))
-    # training batch size
-    batch_size = 500
-    batches_per_epoch = int(np.ceil(float(N) / batch_size))
-
-    N_vad = vad_data_tr.shape[0]
-    idxlist_vad = list(range(N_vad))
-
-    # validation batch size (since the entire validation set might not fit into GPU memory)
-    batch_size_vad = 2000
-
-    # the total number of gradient updates for annealing
-    total_anneal_steps = 200000
-    # largest annealing parameter
-    anneal_cap = 0.2
+    # ratings.csv is preprocessed once; later runs load the cached splits
+    store_dir, n_items = preprocessing.prepare_data(data_dir)
 
     # Train a Multi-VAE
-    p_dims = [200, 600, n_items]
-    tf.reset_default_graph()
-    vae = MultiVAE(p_dims, lam=0.0, random_seed=98765)
-
-    saver, logits_var, loss_var, train_op_var, merged_var = vae.build_graph()
-
-    ndcg_var = tf.Variable(0.0)
-    ndcg_dist_var = tf.placeholder(dtype=tf.float64, shape=None)
-    ndcg_summary = tf.summary.scalar('ndcg_at_k_validation', ndcg_var)
-    ndcg_dist_summary = tf.summary.histogram('ndcg_at_k_hist_validation', ndcg_dist_var)
-    merged_valid = tf.summary.merge([ndcg_summary, ndcg_dist_summary])
-    arch_str = "I-%s-I" % ('-'.join([str(d) for d in vae.dims[1:-1]]))
-    log_dir = './log/ml-20m/VAE_anneal{}K_cap{:1.1E}/{}'.format(
-        total_anneal_steps / 1000, anneal_cap, arch_str)
-
-    if os.path.exists(log_dir):
-        shutil.rmtree(log_dir)
-
-    print("log directory: %s" % log_dir)
-    summary_writer = tf.summary.FileWriter(log_dir, graph=tf.get_default_graph      ())
-    chkpt_dir = './chkpt/ml-20m/VAE_anneal{}K_cap{:1.1E}/{}'.format(
-        total_anneal_steps / 1000, anneal_cap, arch_str)
-
-    if not os.path.isdir(chkpt_dir):
-        os.makedirs(chkpt_dir)
-
-    print("chkpt directory: %s" % chkpt_dir)
-
-    n_epochs = 200
-    ndcgs_vad = []
-
-    with tf.Session() as sess:
-
-        init = tf.global_variables_initializer()
-        sess.run(init)
-
-        best_ndcg = -np.inf
-
-        update_count = 0.0
-
-        for epoch in range(n_epochs):
-            np.random.shuffle(idxlist)
-            # train for one epoch
-            for bnum, st_idx in enumerate(range(0, N, batch_size)):
-                end_idx = min(st_idx + batch_size, N)
-                X = train_data[idxlist[st_idx:end_idx]]
-
-                if sparse.isspmatrix(X):
-                    X = X.toarray()
-                X = X.astype('float32')
-
-                if total_anneal_steps > 0:
-                    anneal = min(anneal_cap, 1. * update_count / total_anneal_steps)
-                else:
-                    anneal = anneal_cap
-
-                feed_dict = {vae.input_ph: X,
-                             vae.keep_prob_ph: 0.5,
-                             vae.anneal_ph: anneal,
-                             vae.is_training_ph: 1}
-                sess.run(train_op_var, feed_dict=feed_dict)
-
-                if bnum % 100 == 0:
-                    summary_train = sess.run(merged_var, feed_dict=feed_dict)
-                    summary_writer.add_summary(summary_train,
-                                               global_step=epoch * batches_per_epoch + bnum)
-
-                update_count += 1
-
-            # compute validation NDCG
-            ndcg_dist = []
-            for bnum, st_idx in enumerate(range(0, N_vad, batch_size_vad)):
-                end_idx = min(st_idx + batch_size_vad, N_vad)
-                X = vad_data_tr[idxlist_vad[st_idx:end_idx]]
-
-                if sparse.isspmatrix(X):
-                    X = X.toarray()
-                X = X.astype('float32')
-
-                pred_val = sess.run(logits_var, feed_dict={vae.input_ph: X})
-                # exclude examples from training and validation (if any)
-                pred_val[X.nonzero()] = -np.inf
-                ndcg_dist.append(NDCG_binary_at_k_batch(pred_val, vad_data_te[idxlist_vad[st_idx:end_idx]]))
-
-            ndcg_dist = np.concatenate(ndcg_dist)
-            ndcg_ = ndcg_dist.mean()
-            ndcgs_vad.append(ndcg_)
-            merged_valid_val = sess.run(merged_valid, feed_dict={ndcg_var: ndcg_, ndcg_dist_var: ndcg_dist})
-            summary_writer.add_summary(merged_valid_val, epoch)
-
-            # update the best model (if necessary)
-            if ndcg_ > best_ndcg:
-                saver.save(sess, '{}/model'.format(chkpt_dir))
-                best_ndcg = ndcg_
-
-    # Plot
-    # plt.figure(figsize=(12, 3))
-    # plt.plot(ndcgs_vad)
-    # plt.ylabel("Validation NDCG@100")
-    # plt.xlabel("Epochs")
-
-    # Load the test data and compute test metrics
-    test_data_tr, test_data_te = load_tr_te_data(
-        os.path.join(pro_dir, 'test_tr.csv'),
-        os.path.join(pro_dir, 'test_te.csv'), n_items)
-    N_test = test_data_tr.shape[0]
-    idxlist_test = range(N_test)
-
-    batch_size_test = 2000
-    tf.reset_default_graph()
-    vae = MultiVAE(p_dims, lam=0.0)
-    saver, logits_var, _, _, _ = vae.build_graph()
-
-    # Load the best performing model on the validation set
-    chkpt_dir = './chkpt/ml-20m/VAE_anneal{}K_cap{:1.1E}/{}'.format(
-        total_anneal_steps / 1000, anneal_cap, arch_str)
-    print("chkpt directory: %s" % chkpt_dir)
-
-    n100_list, r20_list, r50_list = [], [], []
-
-    with tf.Session() as sess:
-        saver.restore(sess, '{}/model'.format(chkpt_dir))
-
-        for bnum, st_idx in enumerate(range(0, N_test, batch_size_test)):
-            end_idx = min(st_idx + batch_size_test, N_test)
-            X = test_data_tr[idxlist_test[st_idx:end_idx]]
-
-            if sparse.isspmatrix(X):
-                X = X.toarray()
-            X = X.astype('float32')
-
-            pred_val = sess.run(logits_var, feed_dict={vae.input_ph: X})
-            # exclude examples from training and validation (if any)
-            pred_val[X.nonzero()] = -np.inf
-            n100_list.append(NDCG_binary_at_k_batch(pred_val, test_data_te[idxlist_test[st_idx:end_idx]], k=100))
-            r20_list.append(Recall_at_k_batch(pred_val, test_data_te[idxlist_test[st_idx:end_idx]], k=20))
-            r50_list.append(Recall_at_k_batch(pred_val, test_data_te[idxlist_test[st_idx:end_idx]], k=50))
-
-    n100_list = np.concatenate(n100_list)
-    r20_list = np.concatenate(r20_list)
-    r50_list = np.concatenate(r50_list)
-
-    print("Test NDCG@100=%.5f (%.5f)" % (np.mean(n100_list), np.std(n100_list) / np.sqrt(len(n100_list))))
-    print("Test Recall@20=%.5f (%.5f)" % (np.mean(r20_list), np.std(r20_list) / np.sqrt(len(r20_list))))
-    print("Test Recall@50=%.5f (%.5f)" % (np.mean(r50_list), np.std(r50_list) / np.sqrt(len(r50_list))))
+    params = models.hyperparameters('vae')
+    log_dir, chkpt_dir = training.run_dirs('vae', params, n_items)
+    training.train('vae', params, store_dir, n_items, log_dir, chkpt_dir, n_shards=n_shards,
+                   shard_devices=shard_devices, **options)
+    training.test('vae', params, store_dir, n_items, chkpt_dir, n_shards=n_shards, shard_devices=shard_devices)
 
     # Train a Multi-DAE
-    p_dims = [200, n_items]
-    tf.reset_default_graph()
-    dae = MultiDAE(p_dims, lam=0.01 / batch_size, random_seed=98765)
-
-    saver, logits_var, loss_var, train_op_var, merged_var = dae.build_graph()
-
-    ndcg_var = tf.Variable(0.0)
-    ndcg_dist_var = tf.placeholder(dtype=tf.float64, shape=None)
-    ndcg_summary = tf.summary.scalar('ndcg_at_k_validation', ndcg_var)
-    ndcg_dist_summary = tf.summary.histogram('ndcg_at_k_hist_validation', ndcg_dist_var)
-    merged_valid = tf.summary.merge([ndcg_summary, ndcg_dist_summary])
-
-    # Set up logging and checkpoint directory
-    arch_str = "I-%s-I" % ('-'.join([str(d) for d in dae.dims[1:-1]]))
-    log_dir = './log/ml-20m/DAE/{}'.format(arch_str)
-
-    if os.path.exists(log_dir):
-        shutil.rmtree(log_dir)
-
-    print("log directory: %s" % log_dir)
-    summary_writer = tf.summary.FileWriter(log_dir, graph=tf.get_default_graph())
-    chkpt_dir = './chkpt/ml-20m/DAE/{}'.format(arch_str)
-
-    if not os.path.isdir(chkpt_dir):
-        os.makedirs(chkpt_dir)
-
-    print("chkpt directory: %s" % chkpt_dir)
-    n_epochs = 200
-    ndcgs_vad = []
-
-    with tf.Session() as sess:
-
-        init = tf.global_variables_initializer()
-        sess.run(init)
-
-        best_ndcg = -np.inf
-
-        for epoch in range(n_epochs):
-            np.random.shuffle(idxlist)
-            # train for one epoch
-            for bnum, st_idx in enumerate(range(0, N, batch_size)):
-                end_idx = min(st_idx + batch_size, N)
-                X = train_data[idxlist[st_idx:end_idx]]
-
-                if sparse.isspmatrix(X):
-                    X = X.toarray()
-                X = X.astype('float32')
-
-                feed_dict = {dae.input_ph: X,
-                             dae.keep_prob_ph: 0.5}
-                sess.run(train_op_var, feed_dict=feed_dict)
-
-                if bnum % 100 == 0:
-                    summary_train = sess.run(merged_var, feed_dict=feed_dict)
-                    summary_writer.add_summary(summary_train, global_step=epoch * batches_per_epoch + bnum)
-
-                    # compute validation NDCG
-            ndcg_dist = []
-            for bnum, st_idx in enumerate(range(0, N_vad, batch_size_vad)):
-                end_idx = min(st_idx + batch_size_vad, N_vad)
-                X = vad_data_tr[idxlist_vad[st_idx:end_idx]]
-
-                if sparse.isspmatrix(X):
-                    X = X.toarray()
-                X = X.astype('float32')
-
-                pred_val = sess.run(logits_var, feed_dict={dae.input_ph: X})
-                # exclude examples from training and validation (if any)
-                pred_val[X.nonzero()] = -np.inf
-                ndcg_dist.append(NDCG_binary_at_k_batch(pred_val, vad_data_te[idxlist_vad[st_idx:end_idx]]))
-
-            ndcg_dist = np.concatenate(ndcg_dist)
-            ndcg_ = ndcg_dist.mean()
-            ndcgs_vad.append(ndcg_)
-            merged_valid_val = sess.run(merged_valid, feed_dict={ndcg_var: ndcg_, ndcg_dist_var: ndcg_dist})
-            summary_writer.add_summary(merged_valid_val, epoch)
-
-            # update the best model (if necessary)
-            if ndcg_ > best_ndcg:
-                saver.save(sess, '{}/model'.format(chkpt_dir))
-                best_ndcg = ndcg_
+    params = models.hyperparameters('dae')
+    log_dir, chkpt_dir = training.run_dirs('dae', params, n_items)
+    ndcgs_vad = training.train('dae', params, store_dir, n_items, log_dir, chkpt_dir, n_shards=n_shards,
+                               shard_devices=shard_devices, **options)
+
     # Plot
+    import matplotlib.pyplot as plt
+    import seaborn as sn
+    sn.set()
     plt.figure(figsize=(12, 3))
     plt.plot(ndcgs_vad)
     plt.ylabel("Validation NDCG@100")
     plt.xlabel("Epochs")
 
-    # Compute test metrics
-    tf.reset_default_graph()
-    dae = MultiDAE(p_dims, lam=0.01 / batch_size)
-    saver, logits_var, _, _, _ = dae.build_graph()
-    # Load the best performing model on the validation set
-    chkpt_dir = './chkpt/ml-20m/DAE/{}'.format(arch_str)
-    print("chkpt directory: %s" % chkpt_dir)
-    n100_list, r20_list, r50_list = [], [], []
-
-    with tf.Session() as sess:
-        saver.restore(sess, '{}/model'.format(chkpt_dir))
-
-        for bnum, st_idx in enumerate(range(0, N_test, batch_size_test)):
-            end_idx = min(st_idx + batch_size_test, N_test)
-            X = test_data_tr[idxlist_test[st_idx:end_idx]]
-
-            if sparse.isspmatrix(X):
-                X = X.toarray()
-            X = X.astype('float32')
-
-            pred_val = sess.run(logits_var, feed_dict={dae.input_ph: X})
-            # exclude examples from training and validation (if any)
-            pred_val[X.nonzero()] = -np.inf
-            n100_list.append(NDCG_binary_at_k_batch(pred_val, test_data_te[idxlist_test[st_idx:end_idx]], k=100))
-            r20_list.append(Recall_at_k_batch(pred_val, test_data_te[idxlist_test[st_idx:end_idx]], k=20))
-            r50_list.append(Recall_at_k_batch(pred_val, test_data_te[idxlist_test[st_idx:end_idx]], k=50))
-
-    n100_list = np.concatenate(n100_list)
-    r20_list = np.concatenate(r20_list)
-    r50_list = np.concatenate(r50_list)
-    print("Test NDCG@100=%.5f (%.5f)" % (np.mean(n100_list), np.std(n100_list) / np.sqrt(len(n100_list))))
-    print("Test Recall@20=%.5f (%.5f)" % (np.mean(r20_list), np.std(r20_list) / np.sqrt(len(r20_list))))
-    print("Test Recall@50=%.5f (%.5f)" % (np.mean(r50_list), np.std(r50_list) / np.sqrt(len(r50_list))))
+    training.test('dae', params, store_dir, n_items, chkpt_dir, n_shards=n_shards, shard_devices=shard_devices)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default=DATA_DIR, help="directory with ratings.csv")
+    training.add_arguments(parser)
+    args = parser.parse_args()
+    main(data_dir=args.data_dir, **training.run_options(args))
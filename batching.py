@@ -0,0 +1,44 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def prefetch_batches(data, idxlist, batch_size, transform=None, shuffle=False, prefetch=4, n_workers=2):
+    '''
+    Iterate over consecutive batch_size chunks of idxlist, yielding (rows, batch) with
+    batch = transform(data[rows]) (or data[rows] without a transform).
+
+    Batches are sliced and converted by n_workers background threads, and up to `prefetch` of them
+    are kept ready ahead of the consumer, so the next batches are prepared while the current one
+    is in sess.run. With shuffle=True, idxlist is shuffled in place with np.random first, exactly
+    like the np.random.shuffle(idxlist) at the top of every epoch.
+    '''
+    if shuffle:
+        np.random.shuffle(idxlist)
+
+    def build(rows):
+        X = data[rows]
+        return rows, (transform(X) if transform is not None else X)
+
+    starts = iter(range(0, len(idxlist), batch_size))
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+
+    def submit_next():
+        st_idx = next(starts, None)
+        if st_idx is not None:
+            pending.append(executor.submit(build, idxlist[st_idx:st_idx + batch_size]))
+
+    try:
+        for _ in range(max(prefetch, 1)):
+            submit_next()
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
+    finally:
+        # the consumer may stop early (e.g. on an exception); drop the batches nobody will read
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
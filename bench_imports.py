@@ -0,0 +1,69 @@
+import argparse
+import json
+import subprocess
+import sys
+
+HEAVY = ['tensorflow', 'matplotlib', 'seaborn', 'pandas']
+
+# module -> heavy dependencies importing it may load; everything else in HEAVY must stay unloaded
+TARGETS = [
+    ('evaluation', []),
+    ('numpy_scorer', []),
+    ('validation', []),
+    ('models', []),
+    ('preprocessing', []),
+    ('training', []),
+    ('cli', []),
+    ('serving', []),
+    ('quantization_drift', []),
+    ('sweep', []),
+    ('Mult_VAE', ['tensorflow']),
+]
+
+PROBE = '''
+import json, sys, time
+t0 = time.time()
+import %s
+print(json.dumps({'seconds': time.time() - t0, 'loaded': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def import_time(module, repeat=3):
+    # best of `repeat` imports, each in a fresh interpreter so nothing is cached in sys.modules
+    best = None
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', PROBE % (module, HEAVY)])
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import time of the repo's modules, and which heavy dependencies "
+                                                 "(TensorFlow, matplotlib, seaborn, pandas) each one pulls in")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-seconds', type=float, default=0.,
+                        help="also fail when a module without TensorFlow takes longer than this to import (0: off)")
+    parser.add_argument('modules', nargs='*', help="only these modules (default: all targets)")
+    args = parser.parse_args()
+
+    failures = []
+    for module, allowed in TARGETS:
+        if args.modules and module not in args.modules:
+            continue
+        result = import_time(module, args.repeat)
+        unexpected = [m for m in result['loaded'] if m not in allowed]
+        print("%-20s %7.3fs  %s" % (module, result['seconds'], ' '.join(result['loaded']) or '-'))
+        if unexpected:
+            failures.append("%s imports %s" % (module, ', '.join(unexpected)))
+        elif args.max_seconds and 'tensorflow' not in allowed and result['seconds'] > args.max_seconds:
+            failures.append("%s takes %.3fs to import (limit %.3fs)" % (module, result['seconds'], args.max_seconds))
+
+    for failure in failures:
+        print("FAIL: %s" % failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
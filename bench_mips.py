@@ -0,0 +1,88 @@
+import argparse
+import time
+import numpy as np
+from scipy import sparse
+
+from evaluation import topk_indices
+from mips_index import ExactIndex, IVFIndex, item_vectors, query_vectors
+
+
+def random_model(n_items, dim, seed):
+    # output layer and decoder states with some cluster structure, when no trained weights are given
+    rng = np.random.RandomState(seed)
+    topics = rng.randn(64, dim).astype(np.float32)
+    weights = (topics[rng.randint(64, size=n_items)] + 0.5 * rng.randn(n_items, dim)).T / np.sqrt(dim)
+    bias = rng.randn(n_items).astype(np.float32)
+    return weights.astype(np.float32), bias, lambda X: np.tanh(X.dot(topics[rng.randint(64, size=X.shape[1])]) +
+                                                               0.5 * rng.randn(X.shape[0], dim))
+
+
+def timed(fn, n_repeats=3):
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.time()
+        result = fn()
+        best = min(best, time.time() - t0)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recall and latency of the MIPS indexes vs. brute-force logits")
+    parser.add_argument('--weights', help="weights.npz from numpy_scorer.export_weights (random model if omitted)")
+    parser.add_argument('--n-items', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=600)
+    parser.add_argument('--users', type=int, default=256)
+    parser.add_argument('--history-len', type=int, default=50)
+    parser.add_argument('--n', type=int, default=100)
+    parser.add_argument('--n-lists', type=int, default=0, help="IVF lists (default sqrt(n_items))")
+    parser.add_argument('--n-probe', default='1,2,4,8,16,32')
+    args = parser.parse_args()
+
+    if args.weights:
+        from numpy_scorer import NumpyScorer
+        scorer = NumpyScorer.load(args.weights)
+        weights, biases = scorer.decoder()
+        weights, bias, hidden = weights[-1], biases[-1], scorer.hidden
+    else:
+        weights, bias, hidden = random_model(args.n_items, args.dim, 98765)
+    n_items = weights.shape[1]
+
+    rng = np.random.RandomState(0)
+    rows = np.repeat(np.arange(args.users), args.history_len)
+    cols = np.concatenate([rng.choice(n_items, args.history_len, replace=False) for _ in range(args.users)])
+    X = sparse.csr_matrix((np.ones(rows.size, dtype=np.float32), (rows, cols)), shape=(args.users, n_items))
+    h = hidden(X)
+    queries = query_vectors(h)
+
+    def brute_force():
+        logits = h.dot(weights) + bias
+        logits[X.nonzero()] = -np.inf
+        return topk_indices(logits, args.n)
+
+    truth, t_brute = timed(brute_force)
+    print("%d items, %d users, top-%d" % (n_items, args.users, args.n))
+    print("%-22s recall@%d=%.4f  %.3f ms/user" % ('brute force', args.n, 1., 1000. * t_brute / args.users))
+
+    items = item_vectors(weights, bias)
+    exact = ExactIndex(items)
+    (idx, _), t_exact = timed(lambda: exact.search(queries, args.n, exclude=X))
+    print("%-22s recall@%d=%.4f  %.3f ms/user" % ('exact blocked', args.n, recall(idx, truth),
+                                                  1000. * t_exact / args.users))
+
+    t0 = time.time()
+    ivf = IVFIndex(items, n_lists=args.n_lists or None)
+    print("IVF with %d lists built in %.2fs" % (ivf.n_lists, time.time() - t0))
+    for n_probe in [int(p) for p in args.n_probe.split(',')]:
+        (idx, _), t_ivf = timed(lambda: ivf.search(queries, args.n, exclude=X, n_probe=n_probe))
+        print("%-22s recall@%d=%.4f  %.3f ms/user" % ('ivf n_probe=%d' % n_probe, args.n, recall(idx, truth),
+                                                      1000. * t_ivf / args.users))
+
+
+def recall(idx, truth):
+    # fraction of the exact top-n that was retrieved
+    hits = [len(np.intersect1d(a, b)) for a, b in zip(idx, truth)]
+    return np.sum(hits) / float(truth.size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import json
+import threading
+import time
+import numpy as np
+
+from urllib.request import Request, urlopen
+
+
+def client(url, n_requests, n_items, history_len, n, seed, latencies, errors):
+    rng = np.random.RandomState(seed)
+    for _ in range(n_requests):
+        items = rng.choice(n_items, size=min(history_len, n_items), replace=False).tolist()
+        body = json.dumps({'items': items, 'n': n}).encode('utf-8')
+        request = Request(url, data=body, headers={'Content-Type': 'application/json'})
+        t0 = time.time()
+        try:
+            json.loads(urlopen(request).read().decode('utf-8'))
+        except Exception:
+            errors.append(1)
+            continue
+        latencies.append(time.time() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test for serving.py: concurrent clients, latency percentiles")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/recommend')
+    parser.add_argument('--n-items', type=int, required=True)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help="requests per client")
+    parser.add_argument('--history-len', type=int, default=20)
+    parser.add_argument('--n', type=int, default=20)
+    args = parser.parse_args()
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(args.url, args.requests, args.n_items, args.history_len,
+                                                     args.n, seed, latencies, errors))
+               for seed in range(args.clients)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+
+    latencies = np.array(latencies) * 1000.
+    print("%d requests from %d clients in %.2fs (%.1f req/s), %d errors" %
+          (latencies.size, args.clients, elapsed, latencies.size / elapsed, len(errors)))
+    if latencies.size:
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print("latency ms: p50=%.2f p90=%.2f p99=%.2f max=%.2f" % (p50, p90, p99, latencies.max()))
+
+
+if __name__ == '__main__':
+    main()
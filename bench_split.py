@@ -0,0 +1,61 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from preprocessing import split_train_test_proportion
+
+
+def split_train_test_proportion_loop(data, test_prop=0.2):
+    # the original per-user implementation, kept as the reference for the benchmark
+    data_grouped_by_user = data.groupby('userId')
+    tr_list, te_list = list(), list()
+
+    np.random.seed(98765)
+
+    for i, (_, group) in enumerate(data_grouped_by_user):
+        n_items_u = len(group)
+
+        if n_items_u >= 5:
+            idx = np.zeros(n_items_u, dtype='bool')
+            idx[np.random.choice(n_items_u, size=int(test_prop * n_items_u), replace=False).astype('int64')] = True
+
+            tr_list.append(group[np.logical_not(idx)])
+            te_list.append(group[idx])
+        else:
+            tr_list.append(group)
+
+    data_tr = pd.concat(tr_list)
+    data_te = pd.concat(te_list)
+
+    return data_tr, data_te
+
+
+def make_interactions(n_users, n_items, mean_items_per_user, seed=0):
+    rng = np.random.RandomState(seed)
+    n_items_u = rng.geometric(1. / mean_items_per_user, size=n_users)
+    users = np.repeat(np.arange(n_users), n_items_u)
+    items = rng.randint(n_items, size=users.size)
+    return pd.DataFrame({'userId': users, 'movieId': items})
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = make_interactions(n_users, n_items=20000, mean_items_per_user=100)
+    print("%d interactions from %d users" % (data.shape[0], n_users))
+
+    for name, fn in [('loop', split_train_test_proportion_loop),
+                     ('vectorized', split_train_test_proportion)]:
+        t0 = time.time()
+        data_tr, data_te = fn(data)
+        elapsed = time.time() - t0
+        print("%-10s %8.2fs  train=%d test=%d" % (name, elapsed, data_tr.shape[0], data_te.shape[0]))
+
+    # same seed must give the same split on every run
+    te_a = split_train_test_proportion(data)[1]
+    te_b = split_train_test_proportion(data)[1]
+    assert te_a.index.equals(te_b.index)
+
+
+if __name__ == '__main__':
+    main()
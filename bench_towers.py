@@ -0,0 +1,73 @@
+import argparse
+import time
+import numpy as np
+from scipy import sparse
+import tensorflow as tf
+
+import models
+import parallel
+
+
+def model_fn(model, p_dims, sparse_input=True, n_shards=1):
+    params = models.hyperparameters(model, p_dims=p_dims[:-1])
+    return lambda: models.build_model(model, params, p_dims[-1], random_seed=98765, sparse_input=sparse_input,
+                                      n_shards=n_shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="training steps/sec of parallel.build_towers vs. number of towers, "
+                                                 "in this process or one worker process per tower")
+    parser.add_argument('--model', choices=['vae', 'vamp', 'iaf'], default='vae')
+    parser.add_argument('--towers', default='1,2,4,8')
+    parser.add_argument('--n-items', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--density', type=float, default=0.005)
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--item-shards', type=int, default=1,
+                        help="item-range shards of the n_items-sized layers")
+    parser.add_argument('--threads', type=int, default=0, help="inter/intra-op threads (0: TF default)")
+    parser.add_argument('--processes', action='store_true',
+                        help="run every tower in its own worker process (parallel.LocalCluster, with --threads "
+                             "threads each, default an equal share of the cores)")
+    args = parser.parse_args()
+
+    data = sparse.random(args.users, args.n_items, density=args.density, format='csr',
+                         dtype=np.float32, random_state=98765)
+    data.data[:] = 1.
+    p_dims = [200, 600, args.n_items]
+    config = tf.ConfigProto(inter_op_parallelism_threads=args.threads, intra_op_parallelism_threads=args.threads)
+    rng = np.random.RandomState(0)
+
+    print("%s, %d items (%d shards), batch %d, %d steps, towers in %s" %
+          (args.model, args.n_items, args.item_shards, args.batch_size, args.steps,
+           'worker processes' if args.processes else 'this process'))
+    base = None
+    for n_towers in [int(n) for n in args.towers.split(',')]:
+        tf.reset_default_graph()
+        cluster = parallel.LocalCluster(n_towers, threads=args.threads or None) if args.processes else None
+        towers, (_, _, _, train_op, _) = parallel.build_towers(
+            model_fn(args.model, p_dims, n_shards=args.item_shards), n_towers, cluster)
+        # the batches are prepared up front so only the training steps are timed
+        feeds = []
+        for _ in range(args.steps + 5):
+            X = data[rng.choice(args.users, args.batch_size, replace=False)]
+            feeds.append(parallel.feed_towers(towers, parallel.split_inputs(X, towers),
+                                              keep_prob_ph=0.5, anneal_ph=0.2, is_training_ph=1))
+        with tf.Session(cluster.target if cluster else '', config=config) as sess:
+            sess.run(tf.global_variables_initializer())
+            for feed_dict in feeds[:5]:
+                sess.run(train_op, feed_dict=feed_dict)
+            t0 = time.time()
+            for feed_dict in feeds[5:]:
+                sess.run(train_op, feed_dict=feed_dict)
+            steps_per_sec = args.steps / (time.time() - t0)
+        if cluster:
+            cluster.close()
+        base = base or steps_per_sec
+        print("towers=%d  %.2f steps/s  %.0f users/s  speedup %.2fx" %
+              (n_towers, steps_per_sec, steps_per_sec * args.batch_size, steps_per_sec / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import os
+import pickle
+
+import numpy as np
+import tensorflow as tf
+
+
+def state_saver():
+    '''
+    Saver over every global variable: the weights plus the optimizer slots (Adam moments and beta
+    powers). Create it after build_graph, once the optimizer variables exist; the model's own
+    saver only covers the weights and is kept for the best-on-validation checkpoint. Two
+    checkpoints are kept so the one state.pkl points to survives until the next one is complete.
+    '''
+    return tf.train.Saver(tf.global_variables(), max_to_keep=2)
+
+
+def save_state(sess, saver, state_dir, **state):
+    '''
+    Full-state checkpoint of a training run: the variables of `saver` and the Python-side loop
+    state (epoch to resume at, update_count, best_ndcg, ...), plus the NumPy RNG state that drives
+    the per-epoch shuffles. The pickle is replaced atomically after the variables are written, so
+    a run killed mid-save resumes from the previous complete checkpoint.
+    '''
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    checkpoint = saver.save(sess, os.path.join(state_dir, 'state'), global_step=state['epoch'])
+    # relative to state_dir, so the run can resume from another working directory or after a move
+    state['checkpoint'] = os.path.relpath(checkpoint, state_dir)
+    state['np_random_state'] = np.random.get_state()
+    tmp_file = os.path.join(state_dir, 'state.pkl.tmp')
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, os.path.join(state_dir, 'state.pkl'))
+
+
+def restore_state(sess, saver, state_dir):
+    # the dict given to save_state, with the variables and the NumPy RNG restored; None if there is none
+    state_file = os.path.join(state_dir, 'state.pkl')
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'rb') as f:
+        state = pickle.load(f)
+    saver.restore(sess, os.path.join(state_dir, state['checkpoint']))
+    np.random.set_state(state.pop('np_random_state'))
+    return state
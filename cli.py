@@ -0,0 +1,88 @@
+import argparse
+
+import models
+import preprocessing
+import training
+
+DATA_DIR = '/media/data1/dingcheng/workspace/baidu/big-data-lab/cf/ml-20m/'
+
+
+def hyperparameters(args):
+    # the model's defaults with the --set name=value overrides
+    return models.hyperparameters(args.model, **dict(
+        (name, models.parse_value(value)) for name, value in (spec.split('=', 1) for spec in args.set)))
+
+
+def cmd_preprocess(args):
+    store_dir, n_items = preprocessing.prepare_data(args.data_dir, chunksize=args.chunk_size,
+                                                    split_format=args.split_format)
+    print("%d items, splits in %s" % (n_items, store_dir))
+
+
+def cmd_models(args):
+    for name in sorted(models.MODELS):
+        print("%-5s %s.%s  %s" % (name, models.MODELS[name][0], models.MODELS[name][1],
+                                  ' '.join('%s=%s' % (key, models.format_value(value))
+                                           for key, value in sorted(models.DEFAULTS[name].items()))))
+
+
+def cmd_train(args):
+    params = hyperparameters(args)
+    store_dir, n_items = preprocessing.prepare_data(args.data_dir, chunksize=args.chunk_size,
+                                                    split_format=args.split_format)
+    log_dir, chkpt_dir = training.run_dirs(args.model, params, n_items)
+    options = training.run_options(args)
+    training.train(args.model, params, store_dir, n_items, log_dir, chkpt_dir, n_epochs=args.epochs, **options)
+    if not args.no_test:
+        training.test(args.model, params, store_dir, n_items, chkpt_dir, n_shards=options['n_shards'],
+                      shard_devices=options['shard_devices'])
+
+
+def cmd_test(args):
+    params = hyperparameters(args)
+    store_dir, n_items = preprocessing.prepare_data(args.data_dir, chunksize=args.chunk_size,
+                                                    split_format=args.split_format)
+    _, chkpt_dir = training.run_dirs(args.model, params, n_items)
+    training.test(args.model, params, store_dir, n_items, chkpt_dir, n_shards=args.item_shards,
+                  shard_devices=args.shard_devices.split(',') if args.shard_devices else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="preprocess ml-20m once, then train / test any registered model "
+                                                 "against the cached splits")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    preprocess = subparsers.add_parser('preprocess', help="build (or reuse) the cached train/validation/test splits")
+    preprocess.set_defaults(func=cmd_preprocess)
+
+    subparsers.add_parser('models', help="list the registered models and their default hyperparameters").set_defaults(
+        func=cmd_models)
+
+    train = subparsers.add_parser('train', help="train a model, then report its test metrics")
+    train.set_defaults(func=cmd_train)
+    train.add_argument('--epochs', type=int, default=200)
+    train.add_argument('--no-test', action='store_true', help="skip the test-set evaluation")
+
+    test = subparsers.add_parser('test', help="test metrics of the best checkpoint of a trained model")
+    test.set_defaults(func=cmd_test)
+    test.add_argument('--item-shards', type=int, default=1, help="the --item-shards the model was trained with")
+    test.add_argument('--shard-devices', default=None)
+
+    for sub in (preprocess, train, test):
+        sub.add_argument('--data-dir', default=DATA_DIR, help="directory with ratings.csv")
+        sub.add_argument('--chunk-size', type=int, default=1 << 22, help="rows of ratings.csv parsed at a time")
+        sub.add_argument('--split-format', choices=['csv', 'parquet'], default='csv',
+                         help="format of the splits exported next to the binary store (parquet needs pyarrow)")
+    for sub in (train, test):
+        sub.add_argument('--model', choices=sorted(models.MODELS), default='vae')
+        sub.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                         help="override a default hyperparameter (repeatable), e.g. anneal_cap=0.3 or p_dims=200-600")
+    training.add_arguments(train)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+MANIFEST = 'manifest.json'
+
+
+def source_digest(path, block_size=1 << 20, **params):
+    '''
+    content hash of the raw ratings file plus the preprocessing parameters, so the
+    cached store is rebuilt when either the input or the way it is split changes
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def read_manifest(store_dir):
+    path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def is_current(store_dir, digest):
+    manifest = read_manifest(store_dir)
+    return manifest is not None and manifest['digest'] == digest
+
+
+def write_manifest(store_dir, digest, n_items):
+    # written last (and atomically) so that an interrupted preprocessing run never looks current
+    tmp_path = os.path.join(store_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'digest': digest, 'n_items': int(n_items)}, f)
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST))
+
+
+def _index_dtype(n):
+    return np.int32 if n < 2 ** 31 else np.int64
+
+
+def save_csr(prefix, rows, cols, n_rows, n_items):
+    '''
+    store the (row, col) pairs of an implicit-feedback matrix as <prefix>.indptr.npy and
+    <prefix>.indices.npy; every stored entry has value 1
+    '''
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    order = np.lexsort((cols, rows))
+    counts = np.bincount(rows, minlength=n_rows)
+
+    indptr = np.zeros(n_rows + 1, dtype=_index_dtype(rows.size))
+    np.cumsum(counts, out=indptr[1:])
+    indices = cols[order].astype(_index_dtype(n_items))
+
+    directory = os.path.dirname(prefix)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    np.save(prefix + '.indptr.npy', indptr)
+    np.save(prefix + '.indices.npy', indices)
+
+
+def save_train_data(prefix, tp, n_items):
+    save_csr(prefix, tp['uid'].values, tp['sid'].values, tp['uid'].max() + 1, n_items)
+
+
+def save_tr_te_data(prefix_tr, prefix_te, tp_tr, tp_te, n_items):
+    # both halves are indexed relative to the first user of the split, as in load_tr_te_data
+    start_idx = min(tp_tr['uid'].min(), tp_te['uid'].min())
+    end_idx = max(tp_tr['uid'].max(), tp_te['uid'].max())
+
+    save_csr(prefix_tr, tp_tr['uid'].values - start_idx, tp_tr['sid'].values, end_idx - start_idx + 1, n_items)
+    save_csr(prefix_te, tp_te['uid'].values - start_idx, tp_te['sid'].values, end_idx - start_idx + 1, n_items)
+
+
+class ImplicitMatrix(object):
+    '''
+    Binary user x item matrix kept as CSR indptr/indices only (int32 where possible); every stored
+    value is implicitly 1. The arrays can be np.memmap views of a store, and indexing with a list of
+    rows returns a scipy.sparse.csr_matrix batch, so it stands in for the CSR matrix in the batch loops.
+    '''
+
+    def __init__(self, indptr, indices, shape, dtype='float32'):
+        self.indptr = indptr
+        self.indices = indices
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def load(cls, prefix, n_items, mmap_mode='r'):
+        indptr = np.load(prefix + '.indptr.npy', mmap_mode=mmap_mode)
+        indices = np.load(prefix + '.indices.npy', mmap_mode=mmap_mode)
+        return cls(indptr, indices, (indptr.size - 1, n_items))
+
+    @classmethod
+    def from_csr(cls, X):
+        X = sparse.csr_matrix(X)
+        X.sum_duplicates()
+        return cls(X.indptr.astype(_index_dtype(X.nnz)), X.indices.astype(_index_dtype(X.shape[1])), X.shape)
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(self.shape[0]))
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+
+        starts = np.asarray(self.indptr[rows], dtype=np.int64)
+        lengths = np.asarray(self.indptr[rows + 1], dtype=np.int64) - starts
+        indptr = np.zeros(rows.size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+
+        # positions of the selected rows' entries in self.indices, gathered in one fancy-indexing read
+        positions = np.arange(indptr[-1]) + np.repeat(starts - indptr[:-1], lengths)
+        indices = np.asarray(self.indices[positions])
+        return sparse.csr_matrix((np.ones(indices.size, dtype=self.dtype), indices, indptr),
+                                 shape=(rows.size, self.shape[1]))
+
+    def item_counts(self):
+        return np.bincount(self.indices, minlength=self.shape[1])
+
+    def tocsr(self):
+        return self[slice(None)]
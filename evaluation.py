@@ -0,0 +1,127 @@
+import numpy as np
+from scipy import sparse
+import bottleneck as bn
+
+
+def topk_indices(X_pred, k):
+    # indices of the k highest scores of every row, sorted by decreasing score
+    batch_users = X_pred.shape[0]
+    if k >= X_pred.shape[1]:
+        return np.argsort(-X_pred, axis=1)
+    idx_topk_part = bn.argpartition(-X_pred, k, axis=1)[:, :k]
+    topk_part = X_pred[np.arange(batch_users)[:, np.newaxis], idx_topk_part]
+    idx_part = np.argsort(-topk_part, axis=1)
+    return idx_topk_part[np.arange(batch_users)[:, np.newaxis], idx_part]
+
+
+def _heldout_keys(heldout_batch):
+    # row * n_items + col of every positive entry of a sparse batch, plus the row of each entry
+    heldout = sparse.csr_matrix(heldout_batch)
+    rows = np.repeat(np.arange(heldout.shape[0], dtype=np.int64), np.diff(heldout.indptr))
+    positive = heldout.data > 0
+    return rows[positive] * heldout.shape[1] + heldout.indices[positive], rows[positive]
+
+
+def heldout_counts(heldout_batch):
+    # number of positive held-out items of every user
+    _, rows = _heldout_keys(heldout_batch)
+    return np.bincount(rows, minlength=heldout_batch.shape[0])
+
+
+def topk_hits(idx_topk, heldout_batch):
+    '''
+    hits[u, j] is True when item idx_topk[u, j] is held out for user u. The top-k indices are
+    intersected with the CSR rows of heldout_batch directly, so only O(batch * k + nnz) memory is
+    used instead of dense [batch, n_items] boolean matrices
+    '''
+    idx_topk = np.asarray(idx_topk, dtype=np.int64)
+    true_keys, _ = _heldout_keys(heldout_batch)
+    topk_keys = np.arange(idx_topk.shape[0], dtype=np.int64)[:, np.newaxis] * heldout_batch.shape[1] + idx_topk
+    return np.isin(topk_keys, true_keys)
+
+
+class TopKEvaluator(object):
+    '''
+    NDCG@k, Recall@k, Precision@k, MAP@k, hit rate@k and catalog coverage@k for several cutoffs,
+    all derived from one sorted top-K list per user with K = max(ks). Batches are added either as
+    full score matrices (one partition per batch for every metric and cutoff) or directly as top-K
+    indices, e.g. from tf.nn.top_k in the graph.
+    '''
+
+    def __init__(self, ks=(20, 50, 100), n_items=None):
+        self.ks = sorted(set(ks))
+        self.K = self.ks[-1]
+        self.n_items = n_items
+        # discount template and ideal DCG for 0..K relevant items
+        self.tp = 1. / np.log2(np.arange(2, self.K + 2))
+        self.idcg = np.r_[0., np.cumsum(self.tp)]
+
+        self.per_user = dict(('%s@%d' % (name, k), [])
+                             for name in ('ndcg', 'recall', 'precision', 'map', 'hitrate') for k in self.ks)
+        self.covered = dict((k, np.zeros(n_items, dtype=bool)) for k in self.ks) if n_items else {}
+
+    def add_scores(self, X_pred, heldout_batch):
+        self.add_topk(topk_indices(X_pred, self.K), heldout_batch)
+
+    def add_topk(self, idx_topk, heldout_batch):
+        '''
+        idx_topk: [batch, >= K] item indices sorted by decreasing score
+        heldout_batch: sparse [batch, n_items] held-out interactions
+        '''
+        idx_topk = np.asarray(idx_topk)[:, :self.K]
+        hits = topk_hits(idx_topk, heldout_batch).astype(np.float64)
+        n_true = heldout_counts(heldout_batch)
+        cum_hits = np.cumsum(hits, axis=1)
+        precision_at_i = cum_hits / np.arange(1, self.K + 1)
+
+        for k in self.ks:
+            n_rel = np.minimum(n_true, k)
+            self.per_user['ndcg@%d' % k].append((hits[:, :k] * self.tp[:k]).sum(axis=1) / self.idcg[n_rel])
+            self.per_user['recall@%d' % k].append(cum_hits[:, k - 1] / n_rel)
+            self.per_user['precision@%d' % k].append(cum_hits[:, k - 1] / k)
+            self.per_user['map@%d' % k].append((precision_at_i[:, :k] * hits[:, :k]).sum(axis=1) / n_rel)
+            self.per_user['hitrate@%d' % k].append((cum_hits[:, k - 1] > 0).astype(np.float64))
+            if k in self.covered:
+                self.covered[k][idx_topk[:, :k].ravel()] = True
+
+    def results(self):
+        '''
+        per-user metric arrays keyed by 'ndcg@k', 'recall@k', 'precision@k', 'map@k' and 'hitrate@k',
+        plus the fraction of the catalog recommended to anyone as 'coverage@k' when n_items is known
+        '''
+        results = dict((name, np.concatenate(values) if values else np.zeros(0))
+                       for name, values in self.per_user.items())
+        for k, covered in self.covered.items():
+            results['coverage@%d' % k] = covered.mean()
+        return results
+
+
+def NDCG_binary_at_k_batch(X_pred, heldout_batch, k=100):
+    '''
+    normalized discounted cumulative gain@k for binary relevance
+    ASSUMPTIONS: all the 0's in heldout_data indicate 0 relevance
+    '''
+    batch_users = X_pred.shape[0]
+    idx_topk_part = bn.argpartition(-X_pred, k, axis=1)
+    topk_part = X_pred[np.arange(batch_users)[:, np.newaxis],
+                       idx_topk_part[:, :k]]
+    idx_part = np.argsort(-topk_part, axis=1)
+    # X_pred[np.arange(batch_users)[:, np.newaxis], idx_topk] is the sorted
+    # topk predicted score
+    idx_topk = idx_topk_part[np.arange(batch_users)[:, np.newaxis], idx_part]
+    # build the discount template
+    tp = 1. / np.log2(np.arange(2, k + 2))
+
+    DCG = (heldout_batch[np.arange(batch_users)[:, np.newaxis],
+                         idx_topk].toarray() * tp).sum(axis=1)
+    IDCG = np.array([(tp[:min(n, k)]).sum()
+                     for n in heldout_batch.getnnz(axis=1)])
+    return DCG / IDCG
+
+
+def Recall_at_k_batch(X_pred, heldout_batch, k=100):
+    # the top-k indices are intersected with the CSR rows of heldout_batch, no dense [batch, n_items] masks
+    idx = bn.argpartition(-X_pred, k, axis=1)[:, :k]
+    tmp = topk_hits(idx, heldout_batch).sum(axis=1).astype(np.float32)
+    recall = tmp / np.minimum(k, heldout_counts(heldout_batch))
+    return recall
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+class IdEncoder(object):
+    '''
+    Maps raw ids (userId / movieId) to dense indices 0..n-1 and back.
+    The i-th entry of `ids` gets index i; lookups are a single searchsorted over a
+    sorted copy of the vocabulary instead of one dict access per row.
+    '''
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids)
+        self._sorter = np.argsort(self.ids, kind='mergesort')
+        self._sorted_ids = self.ids[self._sorter]
+        if np.any(self._sorted_ids[1:] == self._sorted_ids[:-1]):
+            raise ValueError("vocabulary contains duplicate ids")
+        # indices fit in int32 for any realistic catalog, which halves the size of the encoded columns
+        self._sorter = self._sorter.astype(np.int32 if self.ids.size < 2 ** 31 else np.int64)
+
+    def __len__(self):
+        return self.ids.size
+
+    def encode(self, values, unknown='raise'):
+        '''
+        unknown='raise' fails on ids missing from the vocabulary, unknown='mask' maps them to -1
+        '''
+        if unknown not in ('raise', 'mask'):
+            raise ValueError("unknown must be 'raise' or 'mask', got %r" % unknown)
+
+        values = np.asarray(values)
+        pos = np.searchsorted(self._sorted_ids, values)
+        in_range = pos < self.ids.size
+        found = np.zeros(values.shape, dtype=bool)
+        found[in_range] = self._sorted_ids[pos[in_range]] == values[in_range]
+
+        if unknown == 'raise' and not found.all():
+            missing = values[~found]
+            raise KeyError("%d ids are not in the vocabulary (e.g. %s)" % (missing.size, missing[0]))
+
+        codes = np.full(values.shape, -1, dtype=self._sorter.dtype)
+        codes[found] = self._sorter[pos[found]]
+        return codes
+
+    def decode(self, codes):
+        return self.ids[codes]
+
+    def save(self, path):
+        ids = self.ids
+        if ids.dtype.kind in 'iu' and ids.size and np.iinfo(np.int32).min <= ids.min() and ids.max() <= np.iinfo(np.int32).max:
+            ids = ids.astype(np.int32)
+        np.save(path, ids)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
@@ -0,0 +1,190 @@
+import numpy as np
+from scipy import sparse
+
+
+def item_vectors(weights, bias):
+    # rows [w_i, b_i] of the output layer, so that [h, 1] . row_i is the logit of item i
+    return np.hstack([np.asarray(weights).T, np.asarray(bias)[:, np.newaxis]]).astype(np.float32)
+
+
+def query_vectors(h):
+    # decoder states h augmented with the constant 1 that picks up the item bias
+    h = np.asarray(h, dtype=np.float32)
+    return np.hstack([h, np.ones((h.shape[0], 1), dtype=np.float32)])
+
+
+def _top_n(scores, idx, n):
+    # the n best (scores, idx) of every row, sorted by decreasing score
+    if n < scores.shape[1]:
+        part = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        scores = np.take_along_axis(scores, part, axis=1)
+        idx = np.take_along_axis(idx, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def _seen_items(exclude, n_rows):
+    # (rows, cols) of the items to leave out of every row's result
+    if exclude is None:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    rows, cols = sparse.csr_matrix(exclude)[:n_rows].nonzero()
+    return rows, cols
+
+
+class ExactIndex(object):
+    '''
+    Exact maximum-inner-product search over the item vectors. Items are scanned in blocks of
+    block_size and only a running top-n per query is kept, so at most [batch, block_size] scores
+    exist at a time instead of the full [batch, n_items] logits.
+    '''
+
+    def __init__(self, items, block_size=4096):
+        self.items = np.ascontiguousarray(items, dtype=np.float32)
+        self.block_size = block_size
+
+    def __len__(self):
+        return self.items.shape[0]
+
+    def search(self, queries, n, exclude=None):
+        '''
+        queries: [batch, d] from query_vectors; exclude: optional sparse [batch, n_items] whose
+        nonzeros are never returned (the user's history). Returns ([batch, n] item indices,
+        [batch, n] scores), sorted by decreasing score.
+        '''
+        queries = np.asarray(queries, dtype=np.float32)
+        batch = queries.shape[0]
+        rows, cols = _seen_items(exclude, batch)
+        best_idx = np.zeros((batch, 0), dtype=np.int64)
+        best_scores = np.zeros((batch, 0), dtype=np.float32)
+
+        for st_idx in range(0, len(self), self.block_size):
+            end_idx = min(st_idx + self.block_size, len(self))
+            scores = queries.dot(self.items[st_idx:end_idx].T)
+            in_block = (cols >= st_idx) & (cols < end_idx)
+            scores[rows[in_block], cols[in_block] - st_idx] = -np.inf
+            idx = np.broadcast_to(np.arange(st_idx, end_idx), scores.shape)
+            best_idx, best_scores = _top_n(np.hstack([best_scores, scores]), np.hstack([best_idx, idx]), n)
+        return best_idx, best_scores
+
+
+def kmeans(X, n_clusters, n_iter=10, seed=98765):
+    # Lloyd's algorithm; returns (centroids, assignment of every row of X)
+    rng = np.random.RandomState(seed)
+    centroids = X[rng.choice(X.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        # nearest centroid == largest x . c - |c|^2 / 2
+        assign = np.argmax(X.dot(centroids.T) - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, X)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        centroids[empty] = X[rng.choice(X.shape[0], empty.sum(), replace=False)]
+    assign = np.argmax(X.dot(centroids.T) - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+    return centroids, assign
+
+
+class IVFIndex(object):
+    '''
+    Approximate maximum-inner-product search with an inverted file. Every item vector v gets the
+    extra coordinate sqrt(M^2 - |v|^2) (M = the largest item norm) and every query a 0, which turns
+    the largest inner product into the nearest neighbour in L2; the augmented items are clustered
+    into n_lists lists with k-means, and a query only scores the items of its n_probe nearest
+    lists (more when those hold fewer than n unseen items). A batch of queries is answered list by
+    list, with one matrix product per list for all the queries that probe it, written into a
+    per-query candidate buffer that a single top-n then reduces.
+    '''
+
+    def __init__(self, items, n_lists=None, n_probe=8, n_iter=10, seed=98765):
+        items = np.asarray(items, dtype=np.float32)
+        self.n_items = items.shape[0]
+        self.n_lists = n_lists or int(np.sqrt(self.n_items))
+        self.n_probe = n_probe
+
+        norms = (items ** 2).sum(axis=1)
+        augmented = np.hstack([items, np.sqrt(norms.max() - norms)[:, np.newaxis]])
+        self.centroids, assign = kmeans(augmented, self.n_lists, n_iter=n_iter, seed=seed)
+        self.centroid_sq_norms = (self.centroids ** 2).sum(axis=1)
+        # the items of list l are item_ids[offsets[l]:offsets[l + 1]], stored contiguously
+        self.item_ids = np.argsort(assign, kind='stable')
+        self.list_items = np.ascontiguousarray(items[self.item_ids])
+        self.offsets = np.r_[0, np.cumsum(np.bincount(assign, minlength=self.n_lists))]
+        # the list of every item and its position in it
+        self.item_lists = assign
+        self.item_positions = np.empty(self.n_items, dtype=np.int64)
+        self.item_positions[self.item_ids] = np.arange(self.n_items) - self.offsets[assign[self.item_ids]]
+
+    def __len__(self):
+        return self.n_items
+
+    def search(self, queries, n, exclude=None, n_probe=None):
+        # same interface as ExactIndex.search
+        queries = np.asarray(queries, dtype=np.float32)
+        batch = queries.shape[0]
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        rows, cols = _seen_items(exclude, batch)
+        n_seen = np.bincount(rows, minlength=batch)
+        sizes = np.diff(self.offsets)
+
+        # the query's extra coordinate is 0, so only the first d centroid coordinates matter
+        list_scores = queries.dot(self.centroids[:, :-1].T) - 0.5 * self.centroid_sq_norms
+        ranked = np.argsort(-list_scores, axis=1)
+        covered = np.cumsum(sizes[ranked], axis=1)
+        n_probed = np.maximum(n_probe, (covered < (n + n_seen)[:, np.newaxis]).sum(axis=1) + 1)
+        probes = np.zeros((batch, self.n_lists), dtype=bool)
+        probes[np.arange(batch)[:, np.newaxis], ranked] = np.arange(self.n_lists) < n_probed[:, np.newaxis]
+
+        # the scores of every query's candidates go into one row of a [batch, most candidates] buffer,
+        # its probed lists one after another (in list order), so one top-n covers all of them
+        probed_sizes = probes * sizes
+        starts = np.cumsum(probed_sizes, axis=1) - probed_sizes
+        width = probed_sizes.sum(axis=1).max()
+        buffer = np.full((batch, width), -np.inf, dtype=np.float32)
+        for l in np.flatnonzero(probes.any(axis=0) & (sizes > 0)):
+            probing = np.flatnonzero(probes[:, l])
+            columns = starts[probing, l][:, np.newaxis] + np.arange(sizes[l])
+            buffer[probing[:, np.newaxis], columns] = \
+                queries[probing].dot(self.list_items[self.offsets[l]:self.offsets[l + 1]].T)
+
+        # seen items in a probed list are found by position, not by searching the candidates
+        lists, positions = self.item_lists[cols], self.item_positions[cols]
+        in_probed = probes[rows, lists]
+        buffer[rows[in_probed], starts[rows[in_probed], lists[in_probed]] + positions[in_probed]] = -np.inf
+
+        # every query has at least n unseen candidates: keep its n best, then map columns back to items
+        columns, scores = _top_n(buffer, np.broadcast_to(np.arange(width), buffer.shape), n)
+        probe_rows, probe_lists = np.nonzero(probes)
+        probe_starts = probe_rows * width + starts[probe_rows, probe_lists]
+        k = np.searchsorted(probe_starts, np.arange(batch)[:, np.newaxis] * width + columns, side='right') - 1
+        lists = probe_lists[k]
+        idx = self.item_ids[self.offsets[lists] + columns - starts[np.arange(batch)[:, np.newaxis], lists]]
+        return idx, scores
+
+
+def build_index(scorer, kind='exact', **kwargs):
+    # index over the output layer of a numpy_scorer.NumpyScorer
+    weights, biases = scorer.decoder()
+    w = weights[-1].dequantize() if hasattr(weights[-1], 'dequantize') else weights[-1]
+    items = item_vectors(w, biases[-1])
+    if kind == 'exact':
+        return ExactIndex(items, **kwargs)
+    if kind == 'ivf':
+        return IVFIndex(items, **kwargs)
+    raise ValueError("unknown index %r" % kind)
+
+
+class IndexRecommender(object):
+    '''
+    Serves top-n lists from a NumpyScorer's decoder state and an item index, without ever
+    materializing the full logit vector; same recommend(X, n) / n_items interface as NumpyScorer.
+    '''
+
+    def __init__(self, scorer, index):
+        self.scorer = scorer
+        self.index = index
+        self.n_items = scorer.n_items
+
+    def recommend(self, X, n):
+        X = sparse.csr_matrix(X)
+        idx, _ = self.index.search(query_vectors(self.scorer.hidden(X)), n, exclude=X)
+        return idx
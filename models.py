@@ -0,0 +1,81 @@
+import importlib
+
+# name -> (module, class); the classes are imported on first use so that listing models needs no TensorFlow
+MODELS = {
+    'dae': ('Mult_VAE', 'MultiDAE'),
+    'vae': ('Mult_VAE', 'MultiVAE'),
+    'vamp': ('Vamp_VAE', 'Vamp_VAE'),
+    'iaf': ('IAF_VAE', 'IAF_VAE'),
+}
+
+# the hyperparameters of the original experiments; p_dims / iaf_dims are the hidden sizes (n_items is appended)
+DEFAULTS = {
+    'dae': {'p_dims': [200], 'lam': 0.01 / 500, 'lr': 1e-3, 'keep_prob': 0.5, 'batch_size': 500},
+    'vae': {'p_dims': [200, 600], 'lam': 0.0, 'lr': 1e-3, 'keep_prob': 0.5, 'batch_size': 500,
+            'total_anneal_steps': 200000, 'anneal_cap': 0.2},
+    'vamp': {'p_dims': [200, 600], 'K': 3, 'lam': 0.0, 'lr': 1e-3, 'keep_prob': 0.5, 'batch_size': 500,
+             'total_anneal_steps': 200000, 'anneal_cap': 0.2},
+    'iaf': {'p_dims': [200, 600], 'iaf_dims': [200, 200], 'lam': 0.0, 'lr': 1e-3, 'keep_prob': 0.5,
+            'batch_size': 500, 'total_anneal_steps': 200000, 'anneal_cap': 0.2},
+}
+
+# prefix of the log / checkpoint directories of the annealed models
+RUN_PREFIX = {'vae': 'VAE', 'vamp': 'Vamp', 'iaf': 'IAF'}
+
+
+def parse_value(value):
+    # a hyperparameter from the command line: "200-600" -> [200, 600], "3" -> 3, "0.2" / "1e-3" -> float
+    if '-' in value.strip('-') and 'e-' not in value:
+        return [int(v) for v in value.split('-')]
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def format_value(value):
+    return '-'.join(str(v) for v in value) if isinstance(value, list) else value
+
+
+def model_class(name):
+    if name not in MODELS:
+        raise ValueError("unknown model %r (choose from %s)" % (name, ', '.join(sorted(MODELS))))
+    module, cls = MODELS[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+def hyperparameters(name, **overrides):
+    # DEFAULTS[name] updated with overrides; unknown names are an error rather than silently ignored
+    unknown = set(overrides) - set(DEFAULTS[name])
+    if unknown:
+        raise ValueError("unknown hyperparameters for %s: %s" % (name, ', '.join(sorted(unknown))))
+    params = dict(DEFAULTS[name])
+    for key, value in overrides.items():
+        # a single hidden layer ("p_dims=200") is still a list of sizes
+        params[key] = [value] if isinstance(params[key], list) and not isinstance(value, list) else value
+    return params
+
+
+def build_model(name, params, n_items, **kwargs):
+    '''
+    an instance of model `name` with the architecture and regularization of `params`; kwargs go to
+    the constructor as they are (random_seed, sparse_input, n_sampled, n_shards, ...)
+    '''
+    p_dims = list(params['p_dims']) + [n_items]
+    kwargs.update(lam=params['lam'], lr=params['lr'])
+    if name == 'vamp':
+        return model_class(name)(p_dims, params['K'], **kwargs)
+    if name == 'iaf':
+        return model_class(name)(p_dims, list(params['iaf_dims']), **kwargs)
+    return model_class(name)(p_dims, **kwargs)
+
+
+def run_name(name, params, n_items):
+    # e.g. VAE_anneal200.0K_cap2.0E-01/I-600-200-600-I, the directory of a run under ./log and ./chkpt
+    p_dims = list(params['p_dims']) + [n_items]
+    dims = p_dims[::-1] + p_dims[1:]
+    arch_str = "I-%s-I" % ('-'.join([str(d) for d in dims[1:-1]]))
+    if name == 'dae':
+        return 'DAE/{}'.format(arch_str)
+    return '{}_anneal{}K_cap{:1.1E}/{}'.format(RUN_PREFIX[name], params['total_anneal_steps'] / 1000,
+                                              params['anneal_cap'], arch_str)
@@ -0,0 +1,235 @@
+import numpy as np
+from scipy import sparse
+
+from evaluation import topk_indices
+
+
+LAYER_GROUPS = {
+    'dae': ('weights', 'biases'),
+    'vae': ('weights_q', 'biases_q', 'weights_p', 'biases_p'),
+    'vamp': ('weights_q', 'biases_q', 'weights_p', 'biases_p'),
+    'iaf': ('weights_q', 'biases_q', 'weights_p', 'biases_p', 'weights_iaf', 'biases_iaf', 'masks'),
+}
+
+
+def model_kind(model):
+    if hasattr(model, 'weights_iaf'):
+        return 'iaf'
+    if hasattr(model, 'pseudo_inputs'):
+        return 'vamp'
+    if hasattr(model, 'weights_q'):
+        return 'vae'
+    return 'dae'
+
+
+def _item_shards(var):
+    # the variables holding var -- its item-range shards when it is partitioned (tf_ops.item_sharded_variable) --
+    # and the axis they split
+    import tf_ops
+    shards = tf_ops.shards(var)
+    full, first = var.get_shape().as_list(), shards[0].get_shape().as_list()
+    split = [axis for axis in range(len(full)) if full[axis] != first[axis]]
+    return shards, split[0] if split else 0
+
+
+def snapshot_weights(sess, model):
+    # current values of the model's layers as the dict of arrays export_weights writes
+    kind = model_kind(model)
+    fetches = dict((group, [_item_shards(var)[0] for var in getattr(model, group)])
+                   for group in LAYER_GROUPS[kind])
+    if kind == 'vamp':
+        fetches['pseudo_inputs'] = model.pseudo_inputs
+    values = sess.run(fetches)
+
+    arrays = {'kind': np.array(kind), 'q_dims': np.array(model.q_dims), 'p_dims': np.array(model.p_dims)}
+    for group in LAYER_GROUPS[kind]:
+        for i, (var, value) in enumerate(zip(getattr(model, group), values[group])):
+            arrays['%s_%d' % (group, i)] = np.concatenate(value, axis=_item_shards(var)[1])
+    if kind == 'vamp':
+        arrays['pseudo_inputs'] = values['pseudo_inputs']
+    if kind == 'iaf':
+        arrays['iaf_dims'] = np.array(model.iaf_dims)
+    return arrays
+
+
+def export_weights(sess, model, path):
+    '''
+    Dump the trained layers of a MultiDAE / MultiVAE / Vamp_VAE / IAF_VAE (after build_graph, with
+    the weights restored in sess) to a single .npz that NumpyScorer loads without TensorFlow.
+    Vamp_VAE also stores its pseudo-inputs and IAF_VAE its autoregressive masks.
+    '''
+    save_weights(snapshot_weights(sess, model), path)
+
+
+def save_weights(arrays, path):
+    np.savez(path, **arrays)
+
+
+def load_weights(sess, model, path):
+    # assign the layers of an exported .npz back to the model's variables (the IAF masks are constants)
+    with np.load(path) as f:
+        for group in LAYER_GROUPS[model_kind(model)]:
+            if group == 'masks':
+                continue
+            for i, var in enumerate(getattr(model, group)):
+                shards, axis = _item_shards(var)
+                bounds = np.cumsum([shard.get_shape().as_list()[axis] for shard in shards])[:-1]
+                for shard, value in zip(shards, np.split(f['%s_%d' % (group, i)], bounds, axis=axis)):
+                    shard.load(value, sess)
+        if 'pseudo_inputs' in f.files:
+            model.pseudo_inputs.load(f['pseudo_inputs'], sess)
+
+
+def l2_normalize_rows(X):
+    # same as tf.nn.l2_normalize(X, 1): rows scaled by 1 / sqrt(max(sum of squares, 1e-12))
+    if sparse.issparse(X):
+        X = sparse.csr_matrix(X, dtype=np.float32)
+        inv_norm = 1. / np.sqrt(np.maximum(np.asarray(X.multiply(X).sum(axis=1)).ravel(), 1e-12))
+        return sparse.diags(inv_norm.astype(np.float32)).dot(X).tocsr()
+    X = np.asarray(X, dtype=np.float32)
+    return X / np.sqrt(np.maximum((X ** 2).sum(axis=1, keepdims=True), 1e-12))
+
+
+class QuantizedWeights(object):
+    '''
+    [d_in, d_out] layer weights kept as float16, or as int8 with one float32 scale per output
+    column (w[:, j] ~= q[:, j] * scale[j], scale = max |w[:, j]| / 127). Products are computed
+    on float32 copies of block_size columns at a time, so the full float32 matrix is never rebuilt.
+    '''
+
+    def __init__(self, w, dtype='float16', block_size=8192):
+        w = np.asarray(w, dtype=np.float32)
+        self.dtype = dtype
+        self.shape = w.shape
+        self.block_size = block_size
+        if dtype == 'float16':
+            self.values, self.scales = w.astype(np.float16), None
+        elif dtype == 'int8':
+            self.scales = np.maximum(np.abs(w).max(axis=0), 1e-12) / 127.
+            self.values = np.round(w / self.scales).astype(np.int8)
+        else:
+            raise ValueError("unknown dtype %r" % dtype)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dequantize(self, st_idx=0, end_idx=None):
+        w = self.values[:, st_idx:end_idx].astype(np.float32)
+        if self.scales is not None:
+            w *= self.scales[st_idx:end_idx]
+        return w
+
+    def rdot(self, h):
+        # h.dot(w) for a dense or sparse h
+        out = np.empty((h.shape[0], self.shape[1]), dtype=np.float32)
+        for st_idx in range(0, self.shape[1], self.block_size):
+            end_idx = min(st_idx + self.block_size, self.shape[1])
+            out[:, st_idx:end_idx] = h.dot(self.dequantize(st_idx, end_idx))
+        return out
+
+
+def dot(h, w):
+    if isinstance(w, QuantizedWeights):
+        return w.rdot(h)
+    return h.dot(w)
+
+
+def mlp(h, weights, biases):
+    # tanh between the layers, linear output
+    for i, (w, b) in enumerate(zip(weights, biases)):
+        h = dot(h, w) + b
+        if i != len(weights) - 1:
+            h = np.tanh(h)
+    return h
+
+
+class NumpyScorer(object):
+    '''
+    Deterministic scoring path of the trained models (no dropout, z = mean of q) with NumPy/SciPy
+    only: user histories are fed as scipy sparse rows, so only their nonzeros are multiplied with
+    the first encoder layer. recommend(X, n) has the same interface as serving.TFRecommender.
+    '''
+
+    def __init__(self, kind, layers, q_dims, p_dims, iaf_dims=None, pseudo_inputs=None):
+        self.kind = kind
+        self.layers = layers
+        self.q_dims = q_dims
+        self.p_dims = p_dims
+        self.iaf_dims = iaf_dims
+        self.pseudo_inputs = pseudo_inputs
+        self.n_items = p_dims[-1]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls.from_arrays(dict((key, f[key]) for key in f.files))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        # from an exported .npz, or directly from snapshot_weights
+        kind = str(arrays['kind'])
+        layers = {}
+        for group in LAYER_GROUPS[kind]:
+            n_layers = len([key for key in arrays if key.rsplit('_', 1)[0] == group])
+            layers[group] = [arrays['%s_%d' % (group, i)] for i in range(n_layers)]
+        if kind == 'iaf':
+            # the masks are constant, so apply them once instead of on every batch
+            layers['weights_iaf'] = [w * m for w, m in zip(layers['weights_iaf'], layers.pop('masks'))]
+        return cls(kind, layers, arrays['q_dims'].tolist(), arrays['p_dims'].tolist(),
+                   iaf_dims=arrays['iaf_dims'].tolist() if 'iaf_dims' in arrays else None,
+                   pseudo_inputs=arrays.get('pseudo_inputs'))
+
+    def encode(self, X):
+        # latent code the decoder is evaluated at when scoring (is_training_ph = 0)
+        h = l2_normalize_rows(X)
+        if self.kind == 'dae':
+            return h
+        z = mlp(h, self.layers['weights_q'], self.layers['biases_q'])[:, :self.q_dims[-1]]
+        if self.kind == 'iaf':
+            h = mlp(z, self.layers['weights_iaf'], self.layers['biases_iaf'])
+            m_iaf = h[:, :self.iaf_dims[-1]]
+            sigma_iaf = 1. / (1. + np.exp(-h[:, self.iaf_dims[-1]:]))
+            z = sigma_iaf * z + (1. - sigma_iaf) * m_iaf
+        return z
+
+    def quantize(self, dtype='float16'):
+        '''
+        Keep the decoder weights (weights_p, or the p-half of a MultiDAE's layers) as float16 or
+        per-column int8. The encoder and all biases stay float32.
+        '''
+        if dtype == 'float32':
+            return self
+        weights, _ = self.decoder()
+        first = len(self.q_dims) - 1 if self.kind == 'dae' else 0
+        for i in range(first, len(weights)):
+            if not isinstance(weights[i], QuantizedWeights):
+                weights[i] = QuantizedWeights(weights[i], dtype)
+        return self
+
+    def nbytes(self):
+        return sum(w.nbytes for group in self.layers.values() for w in group)
+
+    def decoder(self):
+        if self.kind == 'dae':
+            return self.layers['weights'], self.layers['biases']
+        return self.layers['weights_p'], self.layers['biases_p']
+
+    def hidden(self, X):
+        # input of the output layer, i.e. the state that is dotted with every item column
+        weights, biases = self.decoder()
+        h = self.encode(X)
+        for w, b in zip(weights[:-1], biases[:-1]):
+            h = np.tanh(dot(h, w) + b)
+        return h
+
+    def logits(self, X):
+        weights, biases = self.decoder()
+        return dot(self.hidden(X), weights[-1]) + biases[-1]
+
+    def recommend(self, X, n):
+        # top-n unseen items per row of X, sorted by decreasing score
+        X = sparse.csr_matrix(X)
+        logits = self.logits(X)
+        logits[X.nonzero()] = -np.inf
+        return topk_indices(logits, n)
@@ -0,0 +1,148 @@
+import multiprocessing
+import socket
+
+import numpy as np
+import tensorflow as tf
+from scipy import sparse
+
+import tf_ops
+
+
+def sum_gradients(tower_grads):
+    # element-wise sum of the towers' (gradient, variable) lists; sparse gradients stay sparse
+    summed = []
+    for grads_and_vars in zip(*tower_grads):
+        grads = [g for g, _ in grads_and_vars if g is not None]
+        var = grads_and_vars[0][1]
+        if not grads:
+            continue
+        if isinstance(grads[0], tf.IndexedSlices):
+            grad = tf.IndexedSlices(tf.concat([g.values for g in grads], 0),
+                                    tf.concat([g.indices for g in grads], 0), grads[0].dense_shape)
+        else:
+            grad = tf.add_n(grads)
+        summed.append((grad, var))
+    return summed
+
+
+def build_towers(model_fn, n_towers, cluster=None):
+    '''
+    Data-parallel training graph: n_towers replicas of model_fn() (a MultiDAE / MultiVAE / Vamp_VAE /
+    IAF_VAE constructor) sharing one set of variables, each fed its own slice of the batch. Every
+    tower's loss (a mean over its rows) is scaled by the slice's share of the batch's rows, fed
+    through tower_weight_ph by split_inputs, and the towers' gradients are summed and applied once
+    per step (synchronous all-reduce), so a step on a batch is the single-model step on the same
+    users even when the slices differ in size; the towers' ops run concurrently on the session's
+    inter-op threads. Returns (towers, (saver, logits, loss, train_op, merged)), the same tuple as
+    build_graph, with the saver and logits of tower 0, which also scores validation batches.
+    With a LocalCluster, tower i runs in worker process i % n_workers and the variables, the
+    gradient sum and the update live in its parameter server process.
+    '''
+    towers, tower_grads, losses = [], [], []
+    for i in range(n_towers):
+        # '' keeps the enclosing device scope (None would clear it)
+        device = cluster.tower_device(i) if cluster else ''
+        with tf.variable_scope(tf.get_variable_scope(), reuse=i > 0), tf.name_scope('tower_%d' % i), \
+                tf.device(device):
+            model = model_fn()
+            saver, logits, loss = model.loss_graph()
+            # the tower's fraction of the batch's rows (equal shares unless fed)
+            model.tower_weight_ph = tf.placeholder_with_default(1. / n_towers, shape=None)
+            loss = loss * model.tower_weight_ph
+            if i == 0:
+                optimizer = tf.train.AdamOptimizer(model.lr)
+                tower_saver, tower_logits = saver, logits
+            # the backward pass runs where the tower's forward pass does
+            tower_grads.append(optimizer.compute_gradients(loss, colocate_gradients_with_ops=True))
+        towers.append(model)
+        losses.append(loss)
+
+    train_op = optimizer.apply_gradients(sum_gradients(tower_grads))
+    loss = tf.add_n(losses)
+    merged = tf.summary.merge_all()
+    return towers, (tower_saver, tower_logits, loss, train_op, merged)
+
+
+def split_inputs(X, towers):
+    '''
+    (input_ph value, tower_weight_ph value) of every tower: the rows of the scipy batch X cut
+    into len(towers) nearly equal slices, each weighted by its fraction of the rows. A batch with
+    fewer rows than towers leaves the extra towers one all-zero row with weight 0, so no user is
+    counted twice and no tower is empty.
+    '''
+    X = sparse.csr_matrix(X)
+    n_rows = X.shape[0]
+    inputs = []
+    for tower, part in zip(towers, np.array_split(np.arange(n_rows), len(towers))):
+        if part.size:
+            inputs.append((tf_ops.input_value(X[part], tower.sparse_input), 1. * part.size / n_rows))
+        else:
+            inputs.append((tf_ops.input_value(sparse.csr_matrix((1, X.shape[1]), dtype=X.dtype),
+                                              tower.sparse_input), 0.))
+    return inputs
+
+
+def feed_towers(towers, inputs, **placeholders):
+    # feed_dict of one step: every tower's input_ph and tower_weight_ph get its (slice, weight) from
+    # split_inputs, and each keyword (e.g. keep_prob_ph=0.5) is fed to that placeholder of every tower
+    feed_dict = {}
+    for tower, (X, weight) in zip(towers, inputs):
+        feed_dict[tower.input_ph] = X
+        feed_dict[tower.tower_weight_ph] = weight
+        for name, value in placeholders.items():
+            feed_dict[getattr(tower, name)] = value
+    return feed_dict
+
+
+def _free_ports(n):
+    # n ports nothing listens on right now, for the servers of a LocalCluster
+    sockets = [socket.socket() for _ in range(n)]
+    for sock in sockets:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def _run_server(cluster_def, job_name, task_index, threads):
+    # body of a LocalCluster process: serves its task until terminated
+    config = tf.ConfigProto(inter_op_parallelism_threads=threads, intra_op_parallelism_threads=threads)
+    tf.train.Server(tf.train.ClusterSpec(cluster_def), job_name=job_name, task_index=task_index,
+                    config=config).join()
+
+
+class LocalCluster(object):
+    '''
+    One parameter server and n_workers worker processes on this machine, each a tf.train.Server
+    with its own TensorFlow runtime and `threads` inter/intra-op threads (default: an equal share
+    of the cores), so the towers of build_towers(..., cluster=...) train on separate cores instead
+    of sharing one session's thread pools. Sessions connect to `target`; close() stops the processes.
+    '''
+
+    def __init__(self, n_workers, threads=None):
+        if threads is None:
+            threads = max(multiprocessing.cpu_count() // n_workers, 1)
+        ports = _free_ports(n_workers + 1)
+        self.cluster_def = {'ps': ['localhost:%d' % ports[0]],
+                            'worker': ['localhost:%d' % port for port in ports[1:]]}
+        self.n_workers = n_workers
+        self.target = 'grpc://localhost:%d' % ports[0]
+        # spawned, not forked: TensorFlow may already be initialized in this process
+        context = multiprocessing.get_context('spawn')
+        self.processes = [context.Process(target=_run_server, args=(self.cluster_def, job, task, threads))
+                          for job, task in [('ps', 0)] + [('worker', i) for i in range(n_workers)]]
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+    def tower_device(self, i):
+        # device function of tower i: its ops on worker i % n_workers, its variables on the parameter server
+        return tf.train.replica_device_setter(ps_tasks=1, ps_device='/job:ps/task:0',
+                                              worker_device='/job:worker/task:%d' % (i % self.n_workers))
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,311 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+import data_store
+from id_encoding import IdEncoder
+
+# the splits prepare_data writes, in the order of the pro_sg exports
+SPLITS = ['train', 'validation_tr', 'validation_te', 'test_tr', 'test_te']
+
+
+def filter_triplets(tp, min_uc=5, min_sc=0, usercount=None, itemcount=None):
+    '''
+    Keep the k-core of tp: the largest subset in which every user has at least min_uc interactions
+    and every item at least min_sc users. Dropping users lowers the item counts and vice versa, so
+    the counts are kept with np.bincount over integer-coded ids and the filtering repeats until
+    nothing changes, a few vectorized passes. usercount / itemcount (Series indexed by id, as from
+    read_ratings) are the counts of tp itself and spare the first pass. Returns the filtered tp and
+    the per-user / per-item counts of what is left, indexed by id in increasing order.
+    '''
+    import pandas as pd
+
+    user_ids, user_codes = np.unique(tp['userId'].values, return_inverse=True)
+    item_ids, item_codes = np.unique(tp['movieId'].values, return_inverse=True)
+    if usercount is not None and np.array_equal(usercount.index.values, user_ids):
+        n_user = usercount.values
+    else:
+        n_user = np.bincount(user_codes, minlength=user_ids.size)
+    if itemcount is not None and np.array_equal(itemcount.index.values, item_ids):
+        n_item = itemcount.values
+    else:
+        n_item = np.bincount(item_codes, minlength=item_ids.size)
+
+    keep = np.ones(user_codes.size, dtype=bool)
+    while True:
+        drop = keep & ((n_user[user_codes] < min_uc) | (n_item[item_codes] < min_sc))
+        if not drop.any():
+            break
+        keep &= ~drop
+        n_user = np.bincount(user_codes[keep], minlength=user_ids.size)
+        n_item = np.bincount(item_codes[keep], minlength=item_ids.size)
+
+    usercount = pd.Series(n_user[n_user > 0], index=user_ids[n_user > 0])
+    itemcount = pd.Series(n_item[n_item > 0], index=item_ids[n_item > 0])
+    return tp[keep], usercount, itemcount
+
+
+def _add_counts(counts, values):
+    # running (sorted ids, counts) with one more chunk of ids merged in
+    ids, n = np.unique(values, return_counts=True)
+    if counts is not None:
+        ids, inverse = np.unique(np.concatenate([counts[0], ids]), return_inverse=True)
+        n = np.bincount(inverse, weights=np.concatenate([counts[1], n])).astype(np.int64)
+    return ids, n
+
+
+def read_ratings(ratings_file, min_rating=3.5, chunksize=1 << 22):
+    '''
+    Stream ratings.csv `chunksize` rows at a time, parsing only userId / movieId / rating as
+    int32 / float32 and keeping the (userId, movieId) pairs rated above min_rating, so memory
+    grows with the kept interactions rather than with the raw file. Returns the kept pairs as a
+    DataFrame plus their per-user and per-item counts (Series indexed by id),
+    accumulated chunk by chunk.
+    '''
+    import pandas as pd
+
+    users, items = [], []
+    usercount = itemcount = None
+    for chunk in pd.read_csv(ratings_file, header=0, usecols=['userId', 'movieId', 'rating'],
+                             dtype={'userId': np.int32, 'movieId': np.int32, 'rating': np.float32},
+                             chunksize=chunksize):
+        keep = chunk['rating'].values > min_rating
+        users.append(chunk['userId'].values[keep])
+        items.append(chunk['movieId'].values[keep])
+        usercount = _add_counts(usercount, users[-1])
+        itemcount = _add_counts(itemcount, items[-1])
+
+    tp = pd.DataFrame({'userId': np.concatenate(users), 'movieId': np.concatenate(items)},
+                      columns=['userId', 'movieId'])
+    del users, items
+    return (tp, pd.Series(usercount[1], index=usercount[0]),
+            pd.Series(itemcount[1], index=itemcount[0]))
+
+
+def split_train_test_proportion(data, test_prop=0.2):
+    # Hold out int(test_prop * n_items_u) random items for every user with at least 5 items.
+    # All users are handled in one pass: rows are sorted by user with a random key as
+    # tie-breaker, and a row is held out when its rank inside its user block is small enough.
+    np.random.seed(98765)
+
+    users = data['userId'].values
+    n = users.size
+    order = np.lexsort((np.random.random_sample(n), users))
+    users_sorted = users[order]
+
+    starts = np.flatnonzero(np.r_[True, users_sorted[1:] != users_sorted[:-1]])
+    n_items_u = np.diff(np.r_[starts, n])
+    n_te_u = np.where(n_items_u >= 5, (test_prop * n_items_u).astype('int64'), 0)
+    rank = np.arange(n) - np.repeat(starts, n_items_u)
+
+    idx = np.zeros(n, dtype='bool')
+    idx[order] = rank < np.repeat(n_te_u, n_items_u)
+
+    data_tr = data[np.logical_not(idx)]
+    data_te = data[idx]
+
+    return data_tr, data_te
+
+
+def numerize(tp, user_encoder, item_encoder):
+    import pandas as pd
+
+    uid = user_encoder.encode(tp['userId'].values)
+    sid = item_encoder.encode(tp['movieId'].values)
+    return pd.DataFrame(data={'uid': uid, 'sid': sid}, columns=['uid', 'sid'])
+
+
+def prepare_data(data_dir, min_uc=5, min_sc=0, n_heldout_users=10000, seed=98765, chunksize=1 << 22,
+                 split_format='csv'):
+    '''
+    Preprocess <data_dir>/ratings.csv into the train / validation / test splits under
+    <data_dir>/pro_sg, once: the binary store is reused as long as ratings.csv and the split
+    parameters are unchanged. ratings.csv is streamed `chunksize` rows at a time (see read_ratings).
+    The splits are also written for other tools, as pro_sg/<split>.csv (split_format='csv') or as
+    Parquet under pro_sg/parquet plus pro_sg/items.parquet ('parquet', needs pyarrow); a format
+    whose files are missing is produced by preprocessing again.
+    Returns (store_dir, n_items) for load_train_data / load_tr_te_data.
+    '''
+    if split_format not in ('csv', 'parquet'):
+        raise ValueError("split_format must be 'csv' or 'parquet', got %r" % split_format)
+    pro_dir = os.path.join(data_dir, 'pro_sg')
+    store_dir = os.path.join(pro_dir, 'store')
+    ratings_file = os.path.join(data_dir, 'ratings.csv')
+
+    if not os.path.exists(pro_dir):
+        os.makedirs(pro_dir)
+
+    # Preprocessing is skipped when the binary store was built from the same ratings.csv
+    digest = data_store.source_digest(ratings_file, min_uc=min_uc, min_sc=min_sc, n_heldout_users=n_heldout_users,
+                                      seed=seed, kcore=True)  # kcore: filter_triplets iterates to a fixed point
+    if data_store.is_current(store_dir, digest) and splits_exported(pro_dir, split_format, digest):
+        print("Using preprocessed data in %s" % store_dir)
+    else:
+        import pandas as pd
+
+        # binarize the data (only keep ratings >= 4), one chunk of the file at a time
+        raw_data, usercount, itemcount = read_ratings(ratings_file, chunksize=chunksize)
+        # only keep users with at least min_uc and items with at least min_sc interactions
+        raw_data, user_activity, item_popularity = filter_triplets(raw_data, min_uc=min_uc, min_sc=min_sc,
+                                                                   usercount=usercount, itemcount=itemcount)
+        sparsity = 1. * raw_data.shape[0] / (user_activity.shape[0] * item_popularity.shape[0])
+        print("After filtering, there are %d watching events from %d users and %d movies (sparsity: %.3f%%)" %
+              (raw_data.shape[0], user_activity.shape[0], item_popularity.shape[0], sparsity * 100))
+        unique_uid = user_activity.index
+
+        np.random.seed(seed)
+        idx_perm = np.random.permutation(unique_uid.size)
+        # np.savetxt('idx_prm.txt', idx_perm, fmt='%d')
+        # idx_perm = np.loadtxt('idx_prm.txt', dtype=int)
+        unique_uid = unique_uid[idx_perm]
+        # create train/validation/test users
+        n_users = unique_uid.size
+        tr_users = unique_uid[:(n_users - n_heldout_users * 2)]
+        vd_users = unique_uid[(n_users - n_heldout_users * 2): (n_users - n_heldout_users)]
+        te_users = unique_uid[(n_users - n_heldout_users):]
+        train_plays = raw_data.loc[raw_data['userId'].isin(tr_users)]
+        unique_sid = pd.unique(train_plays['movieId'])
+        item_encoder = IdEncoder(unique_sid)
+        user_encoder = IdEncoder(unique_uid)
+        item_encoder.save(os.path.join(pro_dir, 'unique_sid.npy'))
+        n_items = len(item_encoder)
+        vad_plays = raw_data.loc[raw_data['userId'].isin(vd_users)]
+        vad_plays = vad_plays.loc[vad_plays['movieId'].isin(unique_sid)]
+        vad_plays_tr, vad_plays_te = split_train_test_proportion(vad_plays)
+        test_plays = raw_data.loc[raw_data['userId'].isin(te_users)]
+        test_plays = test_plays.loc[test_plays['movieId'].isin(unique_sid)]
+        test_plays_tr, test_plays_te = split_train_test_proportion(test_plays)
+
+        # Save the data into (user_index, item_index) format
+        train_data = numerize(train_plays, user_encoder, item_encoder)
+        vad_data_tr = numerize(vad_plays_tr, user_encoder, item_encoder)
+        vad_data_te = numerize(vad_plays_te, user_encoder, item_encoder)
+        test_data_tr = numerize(test_plays_tr, user_encoder, item_encoder)
+        test_data_te = numerize(test_plays_te, user_encoder, item_encoder)
+        splits = list(zip(SPLITS, [train_data, vad_data_tr, vad_data_te, test_data_tr, test_data_te]))
+        if split_format == 'parquet':
+            save_parquet_splits(os.path.join(pro_dir, 'parquet'), splits)
+            save_parquet_items(os.path.join(pro_dir, 'items.parquet'), item_encoder)
+        else:
+            for split, tp in splits:
+                tp.to_csv(os.path.join(pro_dir, split + '.csv'), index=False)
+        with open(_export_marker(pro_dir, split_format), 'w') as f:
+            f.write(digest)
+
+        # Keep a binary CSR copy of every split so later runs skip the CSV parsing
+        data_store.save_train_data(os.path.join(store_dir, 'train'), train_data, n_items)
+        data_store.save_tr_te_data(os.path.join(store_dir, 'validation_tr'), os.path.join(store_dir, 'validation_te'),
+                                   vad_data_tr, vad_data_te, n_items)
+        data_store.save_tr_te_data(os.path.join(store_dir, 'test_tr'), os.path.join(store_dir, 'test_te'),
+                                   test_data_tr, test_data_te, n_items)
+        data_store.write_manifest(store_dir, digest, n_items)
+
+    return store_dir, len(IdEncoder.load(os.path.join(pro_dir, 'unique_sid.npy')))
+
+
+def _export_marker(pro_dir, split_format):
+    # digest of the store the exported files of split_format were written with
+    return os.path.join(pro_dir, split_format + '.digest')
+
+
+def splits_exported(pro_dir, split_format, digest):
+    marker = _export_marker(pro_dir, split_format)
+    if not os.path.exists(marker):
+        return False
+    with open(marker, 'r') as f:
+        if f.read().strip() != digest:
+            return False
+    if split_format == 'parquet':
+        paths = [os.path.join(pro_dir, 'parquet', 'split=' + split, 'part-0.parquet') for split in SPLITS]
+        paths.append(os.path.join(pro_dir, 'items.parquet'))
+    else:
+        paths = [os.path.join(pro_dir, split + '.csv') for split in SPLITS]
+    return all(os.path.exists(path) for path in paths)
+
+
+def save_parquet_splits(parquet_dir, splits):
+    '''
+    Write the (name, DataFrame with uid / sid) splits as a Parquet dataset partitioned by split,
+    <parquet_dir>/split=<name>/part-0.parquet, with int32 uid / sid columns
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    for split, tp in splits:
+        split_dir = os.path.join(parquet_dir, 'split=' + split)
+        if not os.path.isdir(split_dir):
+            os.makedirs(split_dir)
+        table = pa.table({'uid': tp['uid'].values.astype(np.int32), 'sid': tp['sid'].values.astype(np.int32)})
+        pq.write_table(table, os.path.join(split_dir, 'part-0.parquet'))
+
+
+def save_parquet_items(path, item_encoder):
+    # sid -> movieId, so that tools reading the Parquet splits can decode the items
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pq.write_table(pa.table({'sid': np.arange(len(item_encoder), dtype=np.int32), 'movieId': item_encoder.ids}), path)
+
+
+def read_parquet_split(split_dir):
+    # (uid, sid) of one split directory; int32 columns without nulls come out of Arrow without a copy
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(split_dir, columns=['uid', 'sid']).combine_chunks()
+    return table.column('uid').to_numpy(), table.column('sid').to_numpy()
+
+
+def _csr(rows, cols, n_rows, n_items):
+    return sparse.csr_matrix((np.ones_like(rows), (rows, cols)), dtype='float64', shape=(n_rows, n_items))
+
+
+def load_train_data(csv_file, n_items):
+    if os.path.isdir(csv_file):
+        # one split of the Parquet dataset, e.g. pro_sg/parquet/split=train
+        rows, cols = read_parquet_split(csv_file)
+        return _csr(rows, cols, rows.max() + 1, n_items)
+    if not csv_file.endswith('.csv'):
+        # split stored by data_store: memory-mapped, sliced into CSR batches on demand
+        return data_store.ImplicitMatrix.load(csv_file, n_items)
+
+    import pandas as pd
+
+    tp = pd.read_csv(csv_file)
+    n_users = tp['uid'].max() + 1
+
+    rows, cols = tp['uid'], tp['sid']
+    data = sparse.csr_matrix((np.ones_like(rows),
+                             (rows, cols)), dtype='float64',
+                             shape=(n_users, n_items))
+    return data
+
+
+def load_tr_te_data(csv_file_tr, csv_file_te, n_items):
+    if os.path.isdir(csv_file_tr):
+        rows_tr, cols_tr = read_parquet_split(csv_file_tr)
+        rows_te, cols_te = read_parquet_split(csv_file_te)
+        start_idx = min(rows_tr.min(), rows_te.min())
+        end_idx = max(rows_tr.max(), rows_te.max())
+        return (_csr(rows_tr - start_idx, cols_tr, end_idx - start_idx + 1, n_items),
+                _csr(rows_te - start_idx, cols_te, end_idx - start_idx + 1, n_items))
+    if not csv_file_tr.endswith('.csv'):
+        return (data_store.ImplicitMatrix.load(csv_file_tr, n_items),
+                data_store.ImplicitMatrix.load(csv_file_te, n_items))
+
+    import pandas as pd
+
+    tp_tr = pd.read_csv(csv_file_tr)
+    tp_te = pd.read_csv(csv_file_te)
+
+    start_idx = min(tp_tr['uid'].min(), tp_te['uid'].min())
+    end_idx = max(tp_tr['uid'].max(), tp_te['uid'].max())
+
+    rows_tr, cols_tr = tp_tr['uid'] - start_idx, tp_tr['sid']
+    rows_te, cols_te = tp_te['uid'] - start_idx, tp_te['sid']
+
+    data_tr = sparse.csr_matrix((np.ones_like(rows_tr), (rows_tr, cols_tr)), dtype='float64',
+                                shape=(end_idx - start_idx + 1, n_items))
+    data_te = sparse.csr_matrix((np.ones_like(rows_te),
+                                 (rows_te, cols_te)), dtype='float64', shape=(end_idx - start_idx + 1, n_items))
+    return data_tr, data_te
@@ -0,0 +1,65 @@
+import argparse
+import os
+import numpy as np
+
+from evaluation import NDCG_binary_at_k_batch, Recall_at_k_batch
+from numpy_scorer import NumpyScorer
+from preprocessing import load_tr_te_data
+
+
+def masked_logits(scorer, X):
+    # scores with the items of X excluded, as in the test loops
+    X_pred = scorer.logits(X)
+    X_pred[X.nonzero()] = -np.inf
+    return X_pred
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NDCG@100 / Recall@20 drift of the reduced-precision decoder "
+                                                 "against the float32 weights")
+    parser.add_argument('--weights', required=True, help="weights.npz from numpy_scorer.export_weights")
+    parser.add_argument('--store-dir', required=True, help="data_store directory with test_tr / test_te")
+    parser.add_argument('--dtypes', default='float16,int8')
+    parser.add_argument('--batch-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    reference = NumpyScorer.load(args.weights)
+    n_items = reference.n_items
+    test_data_tr, test_data_te = load_tr_te_data(os.path.join(args.store_dir, 'test_tr'),
+                                                 os.path.join(args.store_dir, 'test_te'), n_items)
+    N_test = test_data_tr.shape[0]
+    dtypes = args.dtypes.split(',')
+    scorers = dict((dtype, NumpyScorer.load(args.weights).quantize(dtype)) for dtype in dtypes)
+
+    n100 = dict((dtype, []) for dtype in ['float32'] + dtypes)
+    r20 = dict((dtype, []) for dtype in ['float32'] + dtypes)
+    max_diff = dict((dtype, 0.) for dtype in dtypes)
+    for st_idx in range(0, N_test, args.batch_size):
+        end_idx = min(st_idx + args.batch_size, N_test)
+        X = test_data_tr[range(st_idx, end_idx)]
+        heldout = test_data_te[range(st_idx, end_idx)]
+
+        X_ref = masked_logits(reference, X)
+        n100['float32'].append(NDCG_binary_at_k_batch(X_ref, heldout, k=100))
+        r20['float32'].append(Recall_at_k_batch(X_ref, heldout, k=20))
+        for dtype in dtypes:
+            X_pred = masked_logits(scorers[dtype], X)
+            n100[dtype].append(NDCG_binary_at_k_batch(X_pred, heldout, k=100))
+            r20[dtype].append(Recall_at_k_batch(X_pred, heldout, k=20))
+            finite = np.isfinite(X_ref)
+            max_diff[dtype] = max(max_diff[dtype], np.abs(X_pred[finite] - X_ref[finite]).max())
+
+    base_n100, base_r20 = np.concatenate(n100['float32']), np.concatenate(r20['float32'])
+    print("%-8s %10s %10s %10s %10s %12s %10s" % ('decoder', 'NDCG@100', 'drift', 'Recall@20', 'drift',
+                                                 'max |dlogit|', 'MB'))
+    print("%-8s %10.5f %10s %10.5f %10s %12s %10.1f" % ('float32', base_n100.mean(), '', base_r20.mean(), '',
+                                                       '', reference.nbytes() / 2. ** 20))
+    for dtype in dtypes:
+        n100_list, r20_list = np.concatenate(n100[dtype]), np.concatenate(r20[dtype])
+        print("%-8s %10.5f %+10.5f %10.5f %+10.5f %12.2e %10.1f" % (
+            dtype, n100_list.mean(), n100_list.mean() - base_n100.mean(), r20_list.mean(),
+            r20_list.mean() - base_r20.mean(), max_diff[dtype], scorers[dtype].nbytes() / 2. ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def subsample_users(n_users, fraction=1., seed=98765):
+    # a fixed random subset of the validation users, so successive checks stay comparable
+    if fraction >= 1.:
+        return list(range(n_users))
+    rng = np.random.RandomState(seed)
+    return np.sort(rng.choice(n_users, max(int(round(fraction * n_users)), 1), replace=False)).tolist()
+
+
+class TrainingSchedule(object):
+    '''
+    When to validate and when to stop. Validation runs at the end of every validate_every-th epoch,
+    or, with validate_every_steps > 0, at the first epoch end after that many more updates, and
+    always after the last epoch. Training stops once `patience` consecutive validation results
+    (patience = 0: never) have not improved the best NDCG by more than min_delta.
+    '''
+
+    def __init__(self, n_epochs, validate_every=1, validate_every_steps=0, patience=0, min_delta=0.):
+        self.n_epochs = n_epochs
+        self.validate_every = validate_every
+        self.validate_every_steps = validate_every_steps
+        self.patience = patience
+        self.min_delta = min_delta
+
+        self.last_epoch = -1
+        self.last_step = 0
+        self.best = -np.inf
+        self.n_stale = 0
+
+    def due(self, epoch, step):
+        # True (and the check is recorded) when the end of `epoch`, after `step` updates, is validated
+        if epoch + 1 == self.n_epochs:
+            due = True
+        elif self.validate_every_steps > 0:
+            due = step - self.last_step >= self.validate_every_steps
+        else:
+            due = epoch - self.last_epoch >= self.validate_every
+        if due:
+            self.last_epoch, self.last_step = epoch, step
+        return due
+
+    def report(self, ndcg):
+        # record a validation result; True when it improves the best by more than min_delta
+        if ndcg > self.best + self.min_delta:
+            self.best, self.n_stale = ndcg, 0
+            return True
+        self.n_stale += 1
+        return False
+
+    @property
+    def should_stop(self):
+        return self.patience > 0 and self.n_stale >= self.patience
+
+    def state(self):
+        # counters for a full-state checkpoint; the settings come from the command line on resume
+        return {'last_epoch': self.last_epoch, 'last_step': self.last_step, 'best': self.best,
+                'n_stale': self.n_stale}
+
+    def restore(self, state):
+        self.__dict__.update(state)
@@ -0,0 +1,243 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from scipy import sparse
+
+import models
+
+
+def histories_to_csr(histories, n_items):
+    # one row per user history (a list of sids); repeated sids count once
+    indptr = np.r_[0, np.cumsum([len(items) for items in histories])]
+    indices = np.concatenate([np.asarray(items, dtype=np.int64) for items in histories])
+    X = sparse.csr_matrix((np.ones(indices.size, dtype=np.float32), indices, indptr),
+                          shape=(len(histories), n_items))
+    X.sum_duplicates()
+    X.data[:] = 1.
+    return X
+
+
+class TFRecommender(object):
+    '''
+    Restores a trained model once into its own graph and session, and returns the top-n unseen
+    items for a batch of user histories with the in-graph masking/top-k op of the model
+    '''
+
+    def __init__(self, model_fn, chkpt):
+        import tensorflow as tf
+        import tf_ops
+
+        self._input_value = tf_ops.input_value
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.model = model_fn()
+            saver, logits_var, _, _, _ = self.model.build_graph()
+            self.k_ph = tf.placeholder(dtype=tf.int32, shape=[])
+            _, self.topk_var = self.model.topk_graph(logits_var, self.k_ph)
+            self.sess = tf.Session(graph=self.graph)
+            saver.restore(self.sess, chkpt)
+        self.n_items = self.model.dims[0]
+
+    def recommend(self, X, n):
+        feed_dict = {self.model.input_ph: self._input_value(X, self.model.sparse_input),
+                     self.k_ph: n}
+        return self.sess.run(self.topk_var, feed_dict=feed_dict)
+
+
+class MicroBatcher(object):
+    '''
+    Queues concurrent requests and scores them together: the worker thread waits at most
+    max_wait_ms after the first pending request (or until max_batch_size requests are queued)
+    and answers the whole group with one recommender.recommend call.
+    '''
+
+    def __init__(self, recommender, max_batch_size=64, max_wait_ms=2.):
+        self.recommender = recommender
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, items, n):
+        future = Future()
+        self.requests.put((items, n, future))
+        return future
+
+    def recommend(self, items, n, timeout=None):
+        return self.submit(items, n).result(timeout)
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._score(batch)
+
+    def _score(self, batch):
+        try:
+            X = histories_to_csr([items for items, _, _ in batch], self.recommender.n_items)
+            idx_topk = self.recommender.recommend(X, max(n for _, n, _ in batch))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for row, (_, n, future) in zip(idx_topk, batch):
+            future.set_result([int(i) for i in row[:n]])
+
+
+def _is_int(value):
+    # JSON integers only: 1.7, "3" and true are not item ids
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def make_handler(batcher, n_items, default_n=20):
+
+    class RecommendationHandler(BaseHTTPRequestHandler):
+        # POST /recommend {"items": [sid, ...], "n": 20} -> {"items": [sid, ...]}
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/recommend':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+                items = body['items']
+                if not isinstance(items, list) or not all(_is_int(i) for i in items):
+                    raise ValueError("items must be a list of integer item ids")
+                if any(not 0 <= i < n_items for i in items):
+                    raise ValueError("item ids must be in [0, %d)" % n_items)
+                # only unseen items are recommended, so the default n is capped and a larger n rejected
+                n_unseen = n_items - len(set(items))
+                if n_unseen == 0:
+                    raise ValueError("the history already holds every item")
+                n = body.get('n', min(default_n, n_unseen))
+                if not _is_int(n):
+                    raise ValueError("n must be an integer")
+                if not 0 < n <= n_unseen:
+                    raise ValueError("n must be in [1, %d] for this history" % n_unseen)
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            try:
+                recommended = batcher.recommend(items, n)
+            except Exception as e:
+                # raised while scoring the batch this request was part of
+                self._reply(500, {'error': '%s: %s' % (type(e).__name__, e)})
+                return
+            self._reply(200, {'items': recommended})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RecommendationHandler
+
+
+class RecommendationServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections under a burst of concurrent clients
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def model_builder(model, n_items, p_dims, K=3, iaf_dims=(200, 200)):
+    # the architecture must match the one the checkpoint was trained with
+    overrides = {'p_dims': list(p_dims)}
+    if model == 'vamp':
+        overrides['K'] = K
+    if model == 'iaf':
+        overrides['iaf_dims'] = list(iaf_dims)
+    params = models.hyperparameters(model, **overrides)
+    return lambda: models.build_model(model, params, n_items, sparse_input=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve top-n recommendations from a trained checkpoint")
+    parser.add_argument('--model', choices=['dae', 'vae', 'vamp', 'iaf'], default='vae')
+    parser.add_argument('--chkpt', help="checkpoint prefix, e.g. ./chkpt/.../model")
+    parser.add_argument('--weights', help="weights.npz written by numpy_scorer.export_weights; "
+                                          "served with NumPy only, without importing TensorFlow")
+    parser.add_argument('--decoder-dtype', choices=['float32', 'float16', 'int8'], default='float32',
+                        help="with --weights: precision the decoder weights are kept in")
+    parser.add_argument('--index', choices=['none', 'exact', 'ivf'], default='none',
+                        help="with --weights: retrieve the top-n from an item index of the output layer "
+                             "instead of computing every logit")
+    parser.add_argument('--n-lists', type=int, default=0, help="IVF lists (default sqrt(n_items))")
+    parser.add_argument('--n-probe', type=int, default=8, help="IVF lists scanned per request")
+    parser.add_argument('--n-items', type=int, help="required with --chkpt")
+    parser.add_argument('--p-dims', default='200,600', help="decoder dims without n_items")
+    parser.add_argument('--K', type=int, default=3, help="pseudo-inputs of Vamp_VAE")
+    parser.add_argument('--iaf-dims', default='200,200')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.)
+    args = parser.parse_args()
+
+    if args.weights:
+        from numpy_scorer import NumpyScorer
+        recommender = NumpyScorer.load(args.weights).quantize(args.decoder_dtype)
+        args.model, source = recommender.kind, args.weights
+        if args.index != 'none':
+            import mips_index
+            kwargs = dict(n_lists=args.n_lists or None, n_probe=args.n_probe) if args.index == 'ivf' else {}
+            index = mips_index.build_index(recommender, args.index, **kwargs)
+            recommender = mips_index.IndexRecommender(recommender, index)
+    elif args.chkpt and args.n_items:
+        model_fn = model_builder(args.model, args.n_items, [int(d) for d in args.p_dims.split(',')],
+                                 K=args.K, iaf_dims=[int(d) for d in args.iaf_dims.split(',')])
+        recommender = TFRecommender(model_fn, args.chkpt)
+        source = args.chkpt
+    else:
+        parser.error("either --weights or both --chkpt and --n-items are required")
+    batcher = MicroBatcher(recommender, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+
+    server = RecommendationServer((args.host, args.port), make_handler(batcher, recommender.n_items))
+    print("serving %s from %s on http://%s:%d/recommend" % (args.model, source, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import data_store
+import models
+import training
+
+
+def grid_trials(model, grid):
+    '''
+    every combination of the --grid values ({'anneal_cap': [0.1, 0.2], ...}), each a full
+    parameter dict on top of the model's defaults
+    '''
+    keys = sorted(grid)
+    trials = []
+    for values in itertools.product(*[grid[key] for key in keys]):
+        params = models.hyperparameters(model, **dict(zip(keys, values)))
+        trials.append(params)
+    return trials
+
+
+def trial_name(model, params, **options):
+    # checkpoint directory name of a configuration: a sweep in the same --work-dir only ever resumes
+    # a trial trained with exactly these parameters (and training options such as n_sampled)
+    key = json.dumps({'model': model, 'params': params, 'options': options}, sort_keys=True)
+    return 'trial_%s_%s' % (model, hashlib.sha1(key.encode('utf-8')).hexdigest()[:12])
+
+
+def _init_worker(devices):
+    # runs in each fresh worker process, before TensorFlow is imported: one GPU per worker
+    os.environ['CUDA_VISIBLE_DEVICES'] = devices.get()
+
+
+def run_trial(model, params, store_dir, trial_dir, n_epochs, threads=0, **options):
+    '''
+    Train one configuration up to n_epochs epochs in total with training.train, continuing from its
+    full-state checkpoint in trial_dir (where its best model is saved too). options are the other
+    keyword arguments of train(). Returns {'epochs', 'ndcgs', 'seconds'} over the whole life of the trial.
+    '''
+    import tensorflow as tf
+
+    config = tf.ConfigProto(inter_op_parallelism_threads=threads, intra_op_parallelism_threads=threads)
+    config.gpu_options.allow_growth = True
+
+    # training time of the earlier rungs
+    seconds_file = os.path.join(trial_dir, 'seconds.json')
+    seconds = 0.
+    if os.path.exists(seconds_file):
+        with open(seconds_file, 'r') as f:
+            seconds = json.load(f)
+
+    # every worker maps the same store read-only, so the page cache holds one copy of the data
+    n_items = data_store.read_manifest(store_dir)['n_items']
+    t0 = time.time()
+    ndcgs = training.train(model, params, store_dir, n_items, os.path.join(trial_dir, 'log'), trial_dir,
+                           n_epochs=n_epochs, session_config=config, **dict(options, resume=True))
+    seconds += time.time() - t0
+    with open(seconds_file, 'w') as f:
+        json.dump(seconds, f)
+    return {'epochs': n_epochs, 'ndcgs': [float(ndcg) for ndcg in ndcgs], 'seconds': seconds}
+
+
+def successive_halving(n_trials, min_epochs, max_epochs, eta, run_rung):
+    '''
+    Successive halving over trial ids 0..n_trials-1: every surviving trial is trained to the rung's
+    epoch budget (min_epochs, then eta times more each rung, capped at max_epochs) by
+    run_rung(trial_ids, n_epochs) -> {trial: result}, and only the best 1/eta by validation NDCG
+    (at least one) is promoted to the next rung. Yields {trial: (latest result, last rung reached)}
+    after every rung.
+    '''
+    alive = list(range(n_trials))
+    n_epochs, rung = min(min_epochs, max_epochs), 0
+    final = {}
+    while True:
+        results = run_rung(alive, n_epochs)
+        for trial in alive:
+            final[trial] = (results[trial], rung)
+        yield final
+        if n_epochs >= max_epochs:
+            return
+        alive = sorted(alive, key=lambda trial: -max(results[trial]['ndcgs']))[:max(len(alive) // eta, 1)]
+        n_epochs, rung = min(n_epochs * eta, max_epochs), rung + 1
+
+
+def results_table(trials, final, trial_dirs=None):
+    import pandas as pd
+
+    rows = []
+    for trial, params in enumerate(trials):
+        row = {'trial': trial}
+        if trial_dirs:
+            row['dir'] = trial_dirs[trial]
+        row.update((key, models.format_value(value)) for key, value in params.items())
+        if trial in final:
+            result, rung = final[trial]
+            ndcgs = result['ndcgs']
+            row.update({'rung': rung, 'epochs': result['epochs'], 'best_ndcg@100': max(ndcgs),
+                        'best_epoch': int(np.argmax(ndcgs)) + 1, 'last_ndcg@100': ndcgs[-1],
+                        'seconds': result['seconds']})
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    return table.sort_values('best_ndcg@100', ascending=False) if 'best_ndcg@100' in table else table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hyperparameter sweep: grid of trials trained in parallel worker "
+                                                 "processes over one data_store, pruned by successive halving")
+    parser.add_argument('--model', choices=sorted(models.MODELS), default='vae')
+    parser.add_argument('--store-dir', required=True, help="preprocessed data_store directory (train, validation_*)")
+    parser.add_argument('--grid', action='append', default=[],
+                        help="name=v1,v2,... (repeatable), e.g. anneal_cap=0.1,0.2 or p_dims=200-600,100-300")
+    parser.add_argument('--workers', type=int, default=2, help="trials trained at the same time")
+    parser.add_argument('--threads', type=int, default=0, help="TF threads per worker (0: TF default)")
+    parser.add_argument('--gpus', default=None, help="comma-separated GPU ids, one per worker (default: CPU)")
+    parser.add_argument('--min-epochs', type=int, default=5, help="epoch budget of the first rung")
+    parser.add_argument('--max-epochs', type=int, default=200)
+    parser.add_argument('--eta', type=int, default=3, help="1/eta of the trials survive each rung")
+    parser.add_argument('--work-dir', default='./sweep', help="trial checkpoints and the results table")
+    # trials always continue from their own checkpoints, whether or not --resume is given
+    training.add_arguments(parser)
+    args = parser.parse_args()
+    # a budget that does not grow (or starts at 0) would never reach --max-epochs
+    if args.eta < 2:
+        parser.error("--eta must be at least 2")
+    if args.min_epochs < 1:
+        parser.error("--min-epochs must be at least 1")
+    if args.tower_processes:
+        parser.error("--tower-processes is not available in a sweep: the trials already run in --workers processes")
+
+    options = training.run_options(args)
+    grid = dict((name, [models.parse_value(v) for v in values.split(',')])
+                for name, values in (spec.split('=', 1) for spec in args.grid))
+    trials = grid_trials(args.model, grid)
+    trial_dirs = [os.path.join(args.work_dir, trial_name(args.model, params, n_sampled=args.n_sampled))
+                  for params in trials]
+    if not data_store.read_manifest(args.store_dir):
+        parser.error("no preprocessed data in %s (run `cli.py preprocess` first)" % args.store_dir)
+    results_file = os.path.join(args.work_dir, 'results.csv')
+    print("%d %s trials, %d workers, epochs %d..%d (eta %d)" %
+          (len(trials), args.model, args.workers, args.min_epochs, args.max_epochs, args.eta))
+
+    # spawned, not forked: TensorFlow must not be initialized in the parent's copy
+    context = multiprocessing.get_context('spawn')
+    pool_args = {}
+    if args.gpus:
+        gpus = args.gpus.split(',')
+        devices = context.Queue()
+        for i in range(args.workers):
+            devices.put(gpus[i % len(gpus)])
+        pool_args = {'initializer': _init_worker, 'initargs': (devices,)}
+    if not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, **pool_args) as executor:
+        def run_rung(alive, n_epochs):
+            futures = dict((trial, executor.submit(
+                run_trial, args.model, trials[trial], args.store_dir, trial_dirs[trial], n_epochs,
+                threads=args.threads, **options)) for trial in alive)
+            results = {}
+            for trial in alive:
+                results[trial] = futures[trial].result()
+                print("trial %d: %d epochs, best NDCG@100 %.5f (%.0fs)" % (
+                    trial, results[trial]['epochs'], max(results[trial]['ndcgs']), results[trial]['seconds']))
+            return results
+
+        for final in successive_halving(len(trials), args.min_epochs, args.max_epochs, args.eta, run_rung):
+            # rewritten after every rung, so an interrupted sweep still leaves a table behind
+            table = results_table(trials, final, trial_dirs)
+            table.to_csv(results_file, index=False)
+
+    print(table.to_string(index=False))
+    print("results table: %s" % results_file)
+
+
+if __name__ == '__main__':
+    main()
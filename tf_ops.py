@@ -0,0 +1,257 @@
+import os
+import re
+
+import numpy as np
+from scipy import sparse
+import tensorflow as tf
+from tensorflow.python.ops.variables import PartitionedVariable
+
+
+def sparse_input_value(X):
+    # feed value for a tf.sparse_placeholder built from a scipy sparse batch
+    X = sparse.coo_matrix(X)
+    indices = np.column_stack((X.row, X.col)).astype(np.int64)
+    return tf.SparseTensorValue(indices, X.data.astype(np.float32), np.array(X.shape, dtype=np.int64))
+
+
+def input_value(X, is_sparse):
+    # feed value for a model's input_ph, from a scipy sparse or dense batch
+    if is_sparse:
+        return sparse_input_value(X)
+    if sparse.isspmatrix(X):
+        X = X.toarray()
+    return X.astype('float32')
+
+
+def l2_normalize_rows(x):
+    # tf.nn.l2_normalize(x, 1) that only touches the nonzeros when x is a SparseTensor
+    if not isinstance(x, tf.SparseTensor):
+        return tf.nn.l2_normalize(x, 1)
+    square_sum = tf.sparse_reduce_sum(tf.SparseTensor(x.indices, tf.square(x.values), x.dense_shape), axis=1)
+    inv_norm = tf.rsqrt(tf.maximum(square_sum, 1e-12))
+    return tf.SparseTensor(x.indices, x.values * tf.gather(inv_norm, x.indices[:, 0]), x.dense_shape)
+
+
+def dropout(x, keep_prob):
+    if not isinstance(x, tf.SparseTensor):
+        return tf.nn.dropout(x, keep_prob)
+    return tf.SparseTensor(x.indices, tf.nn.dropout(x.values, keep_prob), x.dense_shape)
+
+
+def matmul(x, w):
+    if isinstance(w, PartitionedVariable):
+        # each shard's product is computed where the shard lives
+        if w.get_shape()[0] == list(w)[0].get_shape()[0]:
+            # columns split (an output layer): the outputs are concatenated
+            out = []
+            for shard in w:
+                with tf.device(shard.device):
+                    out.append(matmul(x, shard))
+            return tf.concat(out, 1)
+        # rows split by item range: the sum of every column block of x times its shard
+        out, start = [], 0
+        for shard in w:
+            size = int(shard.get_shape()[0])
+            with tf.device(shard.device):
+                out.append(matmul(slice_columns(x, start, size), shard))
+            start += size
+        return tf.add_n(out)
+    if isinstance(x, tf.SparseTensor):
+        return tf.sparse_tensor_dense_matmul(x, w)
+    return tf.matmul(x, w)
+
+
+def slice_columns(x, start, size):
+    # columns start..start+size of a dense or sparse batch (sparse indices are re-based to 0)
+    if isinstance(x, tf.SparseTensor):
+        return tf.sparse_slice(x, tf.constant([0, start], dtype=tf.int64),
+                               tf.stack([x.dense_shape[0], tf.constant(size, dtype=tf.int64)]))
+    return x[:, start:start + size]
+
+
+def shards(w):
+    # the item-range pieces of a partitioned variable, or [w]
+    return list(w) if isinstance(w, PartitionedVariable) else [w]
+
+
+def all_shards(weights):
+    return [shard for w in weights for shard in shards(w)]
+
+
+def histogram_summaries(name, w):
+    # one histogram per shard, next to it: a histogram of a PartitionedVariable would concatenate it
+    if not isinstance(w, PartitionedVariable):
+        return [tf.summary.histogram(name, w)]
+    out = []
+    for i, shard in enumerate(w):
+        with tf.device(shard.device):
+            out.append(tf.summary.histogram('%s/part_%d' % (name, i), shard))
+    return out
+
+
+def item_sharded_variable(name, shape, item_axis, n_shards, initializer, devices=None):
+    '''
+    tf.get_variable split into n_shards contiguous item ranges along item_axis (a PartitionedVariable).
+    With devices, shard i -- and the optimizer slots, which are colocated with it -- is placed on
+    devices[i % len(devices)], e.g. ['/job:ps/task:0', '/job:ps/task:1'] or ['/cpu:0', '/gpu:0'].
+    '''
+    def device_fn(op):
+        part = re.search(r'/part_(\d+)(/|$)', op.name)
+        return devices[int(part.group(1)) % len(devices)] if part else op.device
+
+    with tf.device(device_fn if devices else None):
+        return tf.get_variable(name=name, shape=shape, initializer=initializer,
+                               partitioner=tf.fixed_size_partitioner(n_shards, axis=item_axis))
+
+
+def output_shards(h, w, b):
+    '''
+    [(logits, start, size)] of an output layer whose columns and bias are partitioned by item range:
+    logits are h w[:, start:start + size] + b[start:start + size], computed next to each shard
+    '''
+    out, start = [], 0
+    for w_shard, b_shard in zip(shards(w), shards(b)):
+        size = int(w_shard.get_shape()[1])
+        with tf.device(w_shard.device):
+            out.append((tf.matmul(h, w_shard) + b_shard, start, size))
+        start += size
+    return out
+
+
+def sharded_multinomial_nll(logit_shards, x):
+    '''
+    -mean_u sum_i x_ui log softmax(logits)_ui from output_shards, without concatenating the logits:
+    the softmax normalizer is the logsumexp of the per-shard logsumexps
+    '''
+    log_norm = tf.reduce_logsumexp(tf.stack([tf.reduce_logsumexp(logits, axis=1)
+                                             for logits, _, _ in logit_shards], axis=1), axis=1)
+    clicked = tf.add_n([rowwise_sum_product(logits, slice_columns(x, start, size))
+                        for logits, start, size in logit_shards])
+    n_clicks = tf.sparse_reduce_sum(x, axis=1) if isinstance(x, tf.SparseTensor) else tf.reduce_sum(x, axis=1)
+    return -tf.reduce_mean(clicked - log_norm * n_clicks)
+
+
+def sharded_sigmoid_nll(logit_shards, x):
+    # sigmoid cross-entropy summed over items (softplus(logits) - logits * x) from output_shards
+    return tf.reduce_mean(tf.add_n([tf.reduce_sum(tf.nn.softplus(logits), axis=1) -
+                                    rowwise_sum_product(logits, slice_columns(x, start, size))
+                                    for logits, start, size in logit_shards]))
+
+
+def sharded_topk(logit_shards, x, k):
+    # global top-k (values, item indices) with the items of x excluded, merged from a top-k per shard
+    values, indices = [], []
+    for logits, start, size in logit_shards:
+        with tf.device(logits.device):
+            v, i = tf.nn.top_k(mask_seen(logits, slice_columns(x, start, size)), tf.minimum(k, size))
+        values.append(v)
+        indices.append(i + start)
+    values, pos = tf.nn.top_k(tf.concat(values, 1), k)
+    # (row, position) pairs instead of tf.batch_gather, which needs the static shape of the indices
+    rows = tf.tile(tf.expand_dims(tf.range(tf.shape(pos)[0]), 1), [1, tf.shape(pos)[1]])
+    return values, tf.gather_nd(tf.concat(indices, 1), tf.stack([rows, pos], axis=2))
+
+
+def rowwise_sum_product(a, x):
+    '''
+    sum_j a[i, j] * x[i, j] for every row i of the dense tensor a; when x is a SparseTensor
+    only the entries of a at its nonzero positions are gathered
+    '''
+    if not isinstance(x, tf.SparseTensor):
+        return tf.reduce_sum(a * x, axis=1)
+    # reshaped so the gradient of the segment sum sees a rank-1 input even when a's rank is not static
+    values = tf.reshape(tf.gather_nd(a, x.indices), [-1]) * x.values
+    return tf.unsorted_segment_sum(values, x.indices[:, 0], tf.shape(a)[0])
+
+
+def input_entries(x):
+    # (row, column, value) of the nonzeros of a dense or sparse input batch
+    if isinstance(x, tf.SparseTensor):
+        return x.indices[:, 0], x.indices[:, 1], x.values
+    indices = tf.where(x > 0)
+    return indices[:, 0], indices[:, 1], tf.gather_nd(x, indices)
+
+
+def unigram_file(item_counts, directory):
+    '''
+    item_counts (at least 1 each) written as <directory>/item_counts.txt, one count per line: the
+    fixed_unigram_candidate_sampler vocab_file, so the sampler kernel reads the counts instead of
+    every tower and every .meta carrying an n_items-long attribute. Kept in the run's directory,
+    next to the meta graphs that refer to it.
+    '''
+    counts = np.maximum(np.asarray(item_counts), 1).astype(np.int64)
+    path = os.path.join(directory, 'item_counts.txt')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    np.savetxt(tmp_path, counts, fmt='%d')
+    os.replace(tmp_path, path)
+    return path
+
+
+def candidate_logits(h, w, b, candidates):
+    '''
+    h w[:, candidates] + b[candidates]; when w and b are partitioned by item range every shard
+    gathers and multiplies only its own candidates, so the output layer is never concatenated
+    '''
+    if not isinstance(w, PartitionedVariable):
+        return tf.matmul(h, tf.gather(w, candidates, axis=1)) + tf.gather(b, candidates)
+    sizes = [int(shard.get_shape()[1]) for shard in w]
+    starts = np.cumsum([0] + sizes[:-1])
+    # shard of every candidate: the number of shard boundaries at or below it
+    shard_ids = tf.reduce_sum(tf.cast(tf.expand_dims(candidates, 1) >= starts[1:], tf.int32), axis=1)
+    positions = tf.dynamic_partition(tf.range(tf.size(candidates)), shard_ids, len(sizes))
+    items = tf.dynamic_partition(candidates, shard_ids, len(sizes))
+    out = []
+    for w_shard, b_shard, start, shard_items in zip(shards(w), shards(b), starts, items):
+        with tf.device(w_shard.device):
+            local = shard_items - start
+            out.append(tf.transpose(tf.matmul(h, tf.gather(w_shard, local, axis=1)) + tf.gather(b_shard, local)))
+    # [n_candidates, batch] rows put back in candidate order
+    return tf.transpose(tf.dynamic_stitch(positions, out))
+
+
+def sampled_softmax_nll(h, w, b, x, n_sampled, item_counts_file=None):
+    '''
+    per-user average multinomial negative log-likelihood of the items in x, with the softmax
+    over the whole catalog replaced by a softmax over the candidate set
+        {items clicked by any user in the batch} + {n_sampled sampled negatives},
+    so only those columns of the output layer (w, b) are multiplied. Negatives are drawn
+    proportionally to the counts in item_counts_file (see unigram_file) or uniformly when it
+    is None, and every candidate's logit is corrected by -log Q(item) of the proposal.
+    '''
+    n_items = int(w.get_shape()[1])
+    rows, cols, values = input_entries(x)
+    pos_items, pos_idx = tf.unique(cols)
+    true_classes = tf.expand_dims(pos_items, 1)
+
+    if item_counts_file is None:
+        sampled, true_expected, sampled_expected = tf.nn.uniform_candidate_sampler(
+            true_classes, num_true=1, num_sampled=n_sampled, unique=True, range_max=n_items)
+    else:
+        sampled, true_expected, sampled_expected = tf.nn.fixed_unigram_candidate_sampler(
+            true_classes, num_true=1, num_sampled=n_sampled, unique=True, range_max=n_items,
+            vocab_file=item_counts_file)
+
+    candidates = tf.concat([pos_items, sampled], 0)
+    log_q = tf.log(tf.concat([tf.reshape(true_expected, [-1]), sampled_expected], 0))
+    logits = candidate_logits(h, w, b, candidates) - log_q
+
+    # a sampled negative that is also clicked in the batch already has its own column
+    # (binary search in the sorted positives, which end with n_items so every lookup is in range)
+    sorted_pos = tf.concat([tf.sort(pos_items), tf.constant([n_items], dtype=pos_items.dtype)], 0)
+    accidental = tf.equal(tf.gather(sorted_pos, tf.searchsorted(sorted_pos, sampled)), sampled)
+    logits += tf.concat([tf.zeros_like(pos_items, dtype=tf.float32),
+                         tf.cast(accidental, tf.float32) * -1e9], 0)
+
+    labels = tf.scatter_nd(tf.stack([rows, tf.cast(pos_idx, tf.int64)], axis=1), values,
+                           tf.stack([tf.shape(h, out_type=tf.int64)[0], tf.size(candidates, out_type=tf.int64)]))
+    return -tf.reduce_mean(tf.reduce_sum(tf.nn.log_softmax(logits) * labels, axis=1))
+
+
+def mask_seen(logits, x):
+    # logits with every item present in the input batch x set to -inf
+    if isinstance(x, tf.SparseTensor):
+        seen = tf.SparseTensor(x.indices, tf.fill(tf.shape(x.values), -np.inf), x.dense_shape)
+        return tf.sparse_add(logits, seen)
+    return tf.where(x > 0, tf.fill(tf.shape(logits), -np.inf), logits)
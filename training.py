@@ -0,0 +1,333 @@
+import os
+import shutil
+
+import numpy as np
+
+import batching
+import models
+import numpy_scorer
+import scheduling
+import validation
+from evaluation import TopKEvaluator
+from preprocessing import load_train_data, load_tr_te_data
+
+
+def add_arguments(parser):
+    # the run options shared by the training scripts, `cli.py train` and sweep.py
+    parser.add_argument('--resume', action='store_true', help="continue from the last full-state checkpoint")
+    parser.add_argument('--checkpoint-every', type=int, default=1, help="epochs between full-state checkpoints")
+    parser.add_argument('--async-validation', action='store_true',
+                        help="validate weight snapshots with the NumPy scorer while the next epoch trains")
+    parser.add_argument('--patience', type=int, default=0,
+                        help="stop after this many validations without improvement (0: train all epochs)")
+    parser.add_argument('--validate-every', type=int, default=1, help="validate every this many epochs")
+    parser.add_argument('--validate-every-steps', type=int, default=0,
+                        help="instead validate at the first epoch end after this many more updates")
+    parser.add_argument('--vad-subsample', type=float, default=1.,
+                        help="fraction of the validation users scored at intermediate checks (the last epoch "
+                             "and new best models are validated on all of them)")
+    parser.add_argument('--towers', type=int, default=1,
+                        help="data-parallel replicas each batch is split across (gradients are averaged)")
+    parser.add_argument('--tower-processes', type=int, default=0,
+                        help="run the towers in this many local worker processes, round-robin, with the "
+                             "variables in a parameter server process (0: all in this process)")
+    parser.add_argument('--item-shards', type=int, default=1,
+                        help="split the n_items-sized layers into this many item ranges (model parallelism)")
+    parser.add_argument('--shard-devices', default=None,
+                        help="comma-separated devices the item shards are placed on round-robin, e.g. /gpu:0,/gpu:1")
+    parser.add_argument('--n-sampled', type=int, default=0,
+                        help="train with a sampled softmax over this many popularity-sampled negatives "
+                             "(0: full softmax)")
+
+
+def run_options(args):
+    # keyword arguments of train() from the parsed add_arguments options
+    return dict(resume=args.resume, checkpoint_every=args.checkpoint_every, async_validation=args.async_validation,
+                patience=args.patience, validate_every=args.validate_every,
+                validate_every_steps=args.validate_every_steps, vad_subsample=args.vad_subsample,
+                n_towers=args.towers, tower_processes=args.tower_processes, n_shards=args.item_shards,
+                shard_devices=args.shard_devices.split(',') if args.shard_devices else None, n_sampled=args.n_sampled)
+
+
+def run_dirs(name, params, n_items, dataset='ml-20m'):
+    # (log_dir, chkpt_dir) of a run
+    run = models.run_name(name, params, n_items)
+    return './log/{}/{}'.format(dataset, run), './chkpt/{}/{}'.format(dataset, run)
+
+
+def train(name, params, store_dir, n_items, log_dir, chkpt_dir, n_epochs=200, resume=False, checkpoint_every=1,
+          async_validation=False, patience=0, validate_every=1, validate_every_steps=0, vad_subsample=1.,
+          n_towers=1, tower_processes=0, n_shards=1, shard_devices=None, n_sampled=0, session_config=None):
+    '''
+    Train model `name` (see models.MODELS) with hyperparameters `params` on the data_store splits in
+    store_dir. The model with the best validation NDCG@100 is saved as <chkpt_dir>/model, TensorBoard
+    summaries go to log_dir. Returns the validation NDCG@100 of every check (with resume, also those
+    of the earlier runs), so calling it again with a larger n_epochs continues a run, as sweep.py does.
+    '''
+    import tensorflow as tf
+
+    import checkpointing
+    import parallel
+    import tf_ops
+
+    train_data = load_train_data(os.path.join(store_dir, 'train'), n_items)
+    vad_data_tr, vad_data_te = load_tr_te_data(os.path.join(store_dir, 'validation_tr'),
+                                               os.path.join(store_dir, 'validation_te'), n_items)
+
+    # Set up training hyperparameters
+    N = train_data.shape[0]
+    idxlist = list(range(N))
+    # training batch size
+    batch_size = params['batch_size']
+    batches_per_epoch = int(np.ceil(float(N) / batch_size))
+
+    # validation users (a fixed random subset of them when vad_subsample < 1). The subset only serves
+    # the intermediate checks: the last epoch, and any subsampled check that beats the best subsampled
+    # score so far, is validated on every user before it can replace the saved best model
+    idxlist_vad = scheduling.subsample_users(vad_data_tr.shape[0], vad_subsample)
+    idxlist_vad_full = list(range(vad_data_tr.shape[0]))
+    subsampled = len(idxlist_vad) < len(idxlist_vad_full)
+
+    # validation batch size (since the entire validation set might not fit into GPU memory)
+    batch_size_vad = 2000
+
+    # number of training batches prepared ahead of the graph, and threads preparing them
+    prefetch_depth = 4
+    n_prep_workers = 2
+
+    # the DAE has no KL term to anneal
+    annealed = name != 'dae'
+    if annealed:
+        # the total number of gradient updates for annealing
+        total_anneal_steps = params['total_anneal_steps']
+        # largest annealing parameter
+        anneal_cap = params['anneal_cap']
+
+    # n_sampled > 0 trains with a sampled softmax over this many popularity-sampled negatives;
+    # validation and test still score the full catalog. The counts are kept in chkpt_dir, which
+    # the saved meta graphs refer to
+    item_counts_file = tf_ops.unigram_file(train_data.item_counts(), chkpt_dir) if n_sampled > 0 else None
+
+    tf.reset_default_graph()
+    # tower_processes > 0: the towers run in local worker processes, each with its own threads
+    cluster = parallel.LocalCluster(min(tower_processes, n_towers)) if tower_processes > 0 else None
+    # every batch is split across n_towers replicas with shared weights and averaged gradients
+    towers, (saver, logits_var, loss_var, train_op_var, merged_var) = parallel.build_towers(
+        lambda: models.build_model(name, params, n_items, random_seed=98765, sparse_input=True,
+                                   n_sampled=n_sampled, item_counts_file=item_counts_file, n_shards=n_shards,
+                                   shard_devices=shard_devices), n_towers, cluster)
+    net = towers[0]
+    _, topk_var = net.topk_graph(logits_var, 100)
+
+    ndcg_var = tf.Variable(0.0)
+    ndcg_dist_var = tf.placeholder(dtype=tf.float64, shape=None)
+    ndcg_summary = tf.summary.scalar('ndcg_at_k_validation', ndcg_var)
+    ndcg_dist_summary = tf.summary.histogram('ndcg_at_k_hist_validation', ndcg_dist_var)
+    merged_valid = tf.summary.merge([ndcg_summary, ndcg_dist_summary])
+
+    # Set up logging and checkpoint directory
+    if os.path.exists(log_dir) and not resume:
+        shutil.rmtree(log_dir)
+
+    print("log directory: %s" % log_dir)
+    summary_writer = tf.summary.FileWriter(log_dir, graph=tf.get_default_graph())
+
+    if not os.path.isdir(chkpt_dir):
+        os.makedirs(chkpt_dir)
+
+    print("chkpt directory: %s" % chkpt_dir)
+
+    # weights, Adam slots and loop state for --resume, saved every checkpoint_every epochs
+    state_saver = checkpointing.state_saver()
+    state_dir = os.path.join(chkpt_dir, 'state')
+
+    # --async-validation: the best epoch is kept as a NumPy snapshot until training ends
+    validator = validation.AsyncValidator(vad_data_tr, vad_data_te, batch_size_vad,
+                                          rows=idxlist_vad) if async_validation else None
+    best_weights_file = '{}/best_weights.npz'.format(chkpt_dir)
+
+    def validate(sess, rows):
+        # per-user validation NDCG@100 of the graph's current weights
+        evaluator_vad = TopKEvaluator(ks=(100,))
+        for st_idx in range(0, len(rows), batch_size_vad):
+            X = vad_data_tr[rows[st_idx:st_idx + batch_size_vad]]
+
+            # items seen in X are excluded inside the graph
+            idx_topk = sess.run(topk_var, feed_dict={net.input_ph: tf_ops.input_value(X, net.sparse_input)})
+            evaluator_vad.add_topk(idx_topk, vad_data_te[rows[st_idx:st_idx + batch_size_vad]])
+        return evaluator_vad.results()['ndcg@100']
+
+    ndcgs_vad = []
+    schedule = scheduling.TrainingSchedule(n_epochs, validate_every=validate_every,
+                                           validate_every_steps=validate_every_steps, patience=patience)
+
+    with tf.Session(cluster.target if cluster else '', config=session_config) as sess:
+
+        init = tf.global_variables_initializer()
+        sess.run(init)
+
+        best_ndcg = -np.inf
+        best_ndcg_subsampled = -np.inf
+
+        update_count = 0.0
+        start_epoch = 0
+
+        state = checkpointing.restore_state(sess, state_saver, state_dir) if resume else None
+        if state is not None:
+            start_epoch, update_count, best_ndcg = state['epoch'], state.get('update_count', 0.), state['best_ndcg']
+            best_ndcg_subsampled = state['best_ndcg_subsampled']
+            ndcgs_vad, idxlist = state['ndcgs_vad'], state['idxlist']
+            schedule.restore(state.get('schedule', {}))
+            print("Resuming from epoch %d" % start_epoch)
+            if async_validation:
+                # an epoch still being validated at save time has exactly the restored weights
+                for epoch_vad in state.get('pending_validation', []):
+                    validator.submit(epoch_vad, numpy_scorer.snapshot_weights(sess, net),
+                                     rows=idxlist_vad_full if epoch_vad + 1 == n_epochs else None)
+
+        for epoch in range(start_epoch, n_epochs):
+            # train for one epoch; batches are shuffled, sliced and converted in background threads
+            batches = batching.prefetch_batches(
+                train_data, idxlist, batch_size, shuffle=True, prefetch=prefetch_depth, n_workers=n_prep_workers,
+                transform=lambda X: parallel.split_inputs(X, towers))
+            for bnum, (_, X) in enumerate(batches):
+                if not annealed:
+                    feed_dict = parallel.feed_towers(towers, X, keep_prob_ph=params['keep_prob'])
+                else:
+                    if total_anneal_steps > 0:
+                        anneal = min(anneal_cap, 1. * update_count / total_anneal_steps)
+                    else:
+                        anneal = anneal_cap
+
+                    feed_dict = parallel.feed_towers(towers, X, keep_prob_ph=params['keep_prob'], anneal_ph=anneal,
+                                                     is_training_ph=1)
+                sess.run(train_op_var, feed_dict=feed_dict)
+
+                if bnum % 100 == 0:
+                    summary_train = sess.run(merged_var, feed_dict=feed_dict)
+                    summary_writer.add_summary(summary_train,
+                                               global_step=epoch * batches_per_epoch + bnum)
+
+                update_count += 1
+
+            # compute validation NDCG when the schedule asks for it
+            validate_now = schedule.due(epoch, (epoch + 1) * batches_per_epoch)
+            if async_validation:
+                # scored from a snapshot on a background thread while the next epoch trains; waits
+                # for the checks of earlier epochs, so best-model tracking lags by at most one epoch
+                if validate_now:
+                    validator.submit(epoch, numpy_scorer.snapshot_weights(sess, net),
+                                     rows=idxlist_vad_full if epoch + 1 == n_epochs else None)
+                finished = validator.poll(wait_before=epoch if epoch + 1 < n_epochs else np.inf)
+            elif not validate_now:
+                finished = []
+            else:
+                finished = [(epoch, validate(sess, idxlist_vad_full if epoch + 1 == n_epochs else idxlist_vad), None)]
+
+            while finished:
+                for epoch_vad, ndcg_dist, weights in finished:
+                    ndcg_ = ndcg_dist.mean()
+                    ndcgs_vad.append(ndcg_)
+                    merged_valid_val = sess.run(merged_valid, feed_dict={ndcg_var: ndcg_, ndcg_dist_var: ndcg_dist})
+                    summary_writer.add_summary(merged_valid_val, epoch_vad)
+
+                    schedule.report(ndcg_)
+
+                    if subsampled and epoch_vad + 1 < n_epochs:
+                        # a subsampled score is only compared with other subsampled scores
+                        if ndcg_ <= best_ndcg_subsampled:
+                            continue
+                        best_ndcg_subsampled = ndcg_
+                        # a synchronous check still has epoch_vad's weights in the graph
+                        ndcg_ = (validate(sess, idxlist_vad_full) if weights is None else
+                                 validator.ndcg(weights, idxlist_vad_full)).mean()
+
+                    # update the best model (if necessary)
+                    if ndcg_ > best_ndcg:
+                        if weights is None:
+                            saver.save(sess, '{}/model'.format(chkpt_dir))
+                        else:
+                            numpy_scorer.save_weights(weights, best_weights_file)
+                        best_ndcg = ndcg_
+
+                # before stopping early, the snapshot still being scored is waited for: it may be
+                # the best model, or show (as a synchronous check would) that training should go on
+                finished = validator.poll(wait_before=np.inf) if async_validation and schedule.should_stop else []
+
+            # an early-stopped run is saved as finished, so --resume goes straight to the test phase
+            if schedule.should_stop or (epoch + 1) % checkpoint_every == 0 or epoch + 1 == n_epochs:
+                checkpointing.save_state(sess, state_saver, state_dir,
+                                         epoch=n_epochs if schedule.should_stop else epoch + 1,
+                                         update_count=update_count, best_ndcg=best_ndcg,
+                                         best_ndcg_subsampled=best_ndcg_subsampled, ndcgs_vad=ndcgs_vad,
+                                         idxlist=idxlist,
+                                         pending_validation=list(validator.pending) if validator else [],
+                                         schedule=schedule.state())
+            if schedule.should_stop:
+                print("Validation NDCG@100 did not improve in %d checks, stopping after epoch %d" %
+                      (schedule.patience, epoch + 1))
+                break
+
+        if async_validation:
+            validator.close()
+            if os.path.exists(best_weights_file):
+                # write the best snapshot as the checkpoint the test phase restores
+                numpy_scorer.load_weights(sess, net, best_weights_file)
+                saver.save(sess, '{}/model'.format(chkpt_dir))
+
+    if cluster:
+        cluster.close()
+    return ndcgs_vad
+
+
+def test(name, params, store_dir, n_items, chkpt_dir, n_shards=1, shard_devices=None):
+    '''
+    Test NDCG@100, Recall@20/50 and Coverage@100 of the best model in chkpt_dir (printed and
+    returned as TopKEvaluator.results()); also exports it as <chkpt_dir>/weights.npz for the NumPy scorer.
+    '''
+    import tensorflow as tf
+
+    import tf_ops
+
+    # Load the test data and compute test metrics
+    test_data_tr, test_data_te = load_tr_te_data(
+        os.path.join(store_dir, 'test_tr'),
+        os.path.join(store_dir, 'test_te'), n_items)
+    N_test = test_data_tr.shape[0]
+    idxlist_test = range(N_test)
+
+    batch_size_test = 2000
+    tf.reset_default_graph()
+    net = models.build_model(name, params, n_items, sparse_input=True, n_shards=n_shards,
+                             shard_devices=shard_devices)
+    saver, logits_var, _, _, _ = net.build_graph()
+    _, topk_var = net.topk_graph(logits_var, 100)
+
+    # Load the best performing model on the validation set
+    print("chkpt directory: %s" % chkpt_dir)
+
+    # NDCG/Recall/Precision/MAP at every cutoff come from one top-100 per user
+    evaluator = TopKEvaluator(ks=(20, 50, 100), n_items=n_items)
+
+    with tf.Session() as sess:
+        saver.restore(sess, '{}/model'.format(chkpt_dir))
+
+        for bnum, st_idx in enumerate(range(0, N_test, batch_size_test)):
+            end_idx = min(st_idx + batch_size_test, N_test)
+            X = test_data_tr[idxlist_test[st_idx:end_idx]]
+
+            # items seen in X are excluded inside the graph
+            idx_topk = sess.run(topk_var, feed_dict={net.input_ph: tf_ops.input_value(X, net.sparse_input)})
+            evaluator.add_topk(idx_topk, test_data_te[idxlist_test[st_idx:end_idx]])
+
+        # TensorFlow-free copy of the best model (verify_scorer.py checks it against the graph)
+        numpy_scorer.export_weights(sess, net, '{}/weights.npz'.format(chkpt_dir))
+
+    results = evaluator.results()
+    n100_list, r20_list, r50_list = results['ndcg@100'], results['recall@20'], results['recall@50']
+
+    print("Test NDCG@100=%.5f (%.5f)" % (np.mean(n100_list), np.std(n100_list) / np.sqrt(len(n100_list))))
+    print("Test Recall@20=%.5f (%.5f)" % (np.mean(r20_list), np.std(r20_list) / np.sqrt(len(r20_list))))
+    print("Test Recall@50=%.5f (%.5f)" % (np.mean(r50_list), np.std(r50_list) / np.sqrt(len(r50_list))))
+    print("Test Coverage@100=%.5f" % results['coverage@100'])
+    return results
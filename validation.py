@@ -0,0 +1,54 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from evaluation import TopKEvaluator
+from numpy_scorer import NumpyScorer
+
+
+class AsyncValidator(object):
+    '''
+    Validation NDCG@k of weight snapshots (numpy_scorer.snapshot_weights), computed with the NumPy
+    scorer on a background thread so that the next epoch trains in the meantime. BLAS and the
+    TF kernels both release the GIL, so the two overlap. Snapshots are scored one at a time in
+    the order they were submitted. Only the users in `rows` (default: all) are scored, unless a
+    submission gives its own.
+    '''
+
+    def __init__(self, data_tr, data_te, batch_size=2000, k=100, rows=None):
+        self.data_tr = data_tr
+        self.data_te = data_te
+        self.rows = rows if rows is not None else list(range(data_tr.shape[0]))
+        self.batch_size = batch_size
+        self.k = k
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = collections.OrderedDict()    # epoch -> (future, weights)
+
+    def submit(self, epoch, weights, rows=None):
+        self.pending[epoch] = (self.executor.submit(self.ndcg, weights, rows), weights)
+
+    def poll(self, wait_before=None):
+        '''
+        (epoch, per-user NDCG@k, weights) of the finished snapshots, in epoch order; blocks until
+        every snapshot of an epoch < wait_before is scored (pass float('inf') to drain)
+        '''
+        finished = []
+        for epoch in list(self.pending):
+            future, weights = self.pending[epoch]
+            if not (future.done() or (wait_before is not None and epoch < wait_before)):
+                break
+            finished.append((epoch, future.result(), weights))
+            del self.pending[epoch]
+        return finished
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def ndcg(self, weights, rows=None):
+        # per-user NDCG@k of a snapshot, computed on the calling thread
+        rows = self.rows if rows is None else rows
+        scorer = NumpyScorer.from_arrays(weights)
+        evaluator = TopKEvaluator(ks=(self.k,))
+        for st_idx in range(0, len(rows), self.batch_size):
+            batch = rows[st_idx:st_idx + self.batch_size]
+            evaluator.add_topk(scorer.recommend(self.data_tr[batch], self.k), self.data_te[batch])
+        return evaluator.results()['ndcg@%d' % self.k]
@@ -0,0 +1,59 @@
+import argparse
+import os
+import sys
+import numpy as np
+
+import data_store
+import models
+import numpy_scorer
+import training
+from preprocessing import load_tr_te_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check that the NumPy scorer reproduces the TensorFlow logits of a "
+                                                 "trained model on the first test users")
+    parser.add_argument('--model', choices=sorted(models.MODELS), default='vae')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="hyperparameters the model was trained with (see cli.py train)")
+    parser.add_argument('--store-dir', required=True, help="data_store directory with test_tr / test_te")
+    parser.add_argument('--chkpt-dir', default=None, help="default: the run directory of --model / --set")
+    parser.add_argument('--item-shards', type=int, default=1)
+    parser.add_argument('--shard-devices', default=None)
+    parser.add_argument('--users', type=int, default=2000, help="test users compared")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--tolerance', type=float, default=1e-4, help="largest |logit diff| accepted")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+
+    import tf_ops
+
+    params = models.hyperparameters(args.model, **dict(
+        (name, models.parse_value(value)) for name, value in (spec.split('=', 1) for spec in args.set)))
+    n_items = data_store.read_manifest(args.store_dir)['n_items']
+    chkpt_dir = args.chkpt_dir or training.run_dirs(args.model, params, n_items)[1]
+    test_data_tr, _ = load_tr_te_data(os.path.join(args.store_dir, 'test_tr'),
+                                      os.path.join(args.store_dir, 'test_te'), n_items)
+    N = min(args.users, test_data_tr.shape[0])
+
+    net = models.build_model(args.model, params, n_items, sparse_input=True, n_shards=args.item_shards,
+                             shard_devices=args.shard_devices.split(',') if args.shard_devices else None)
+    saver, logits_var, _, _, _ = net.build_graph()
+
+    max_diff = 0.
+    with tf.Session() as sess:
+        saver.restore(sess, '{}/model'.format(chkpt_dir))
+        scorer = numpy_scorer.NumpyScorer.from_arrays(numpy_scorer.snapshot_weights(sess, net))
+        # batch by batch, so only [batch_size, n_items] logits are held at a time
+        for st_idx in range(0, N, args.batch_size):
+            X = test_data_tr[list(range(st_idx, min(st_idx + args.batch_size, N)))]
+            logits_tf = sess.run(logits_var, feed_dict={net.input_ph: tf_ops.input_value(X, net.sparse_input)})
+            max_diff = max(max_diff, float(np.abs(scorer.logits(X) - logits_tf).max()))
+
+    print("%s, %d test users: NumPy scorer max |logit diff| vs TF %.2e" % (chkpt_dir, N, max_diff))
+    sys.exit(0 if max_diff <= args.tolerance else 1)
+
+
+if __name__ == '__main__':
+    main()